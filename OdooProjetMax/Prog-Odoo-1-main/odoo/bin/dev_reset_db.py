@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright 2026 Kal-It
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""Reset a database restored from production for dev and integration.
+
+Often in development or integration mode, we retrieve a database from a
+production server. Before the migration, this script:
+
+* stores the attachments in the database instead of S3 or Swift, as there
+  is no bucket in dev (unless ODOO_DEV_KEEP_ATTACHMENT_S3=true)
+* sets the password of the users to their login (dev only)
+* sets a random database uuid, for the license management done by
+  odoo.com (not in prod, unless ODOO_KEEP_DATABASE_UUID=true)
+
+The web attachments (/web/content) stored on S3 or Swift are deleted,
+the ones in the database or the filestore are readable and kept. The
+other S3 attachments can be moved to the database
+(ODOO_DEV_MOVE_ATTACHMENT_S3=db) or the filestore
+(ODOO_DEV_MOVE_ATTACHMENT_S3=file). This is done by batches of
+ODOO_DEV_ATTACHMENT_BATCH_SIZE deleted attachments (10000) or
+ODOO_DEV_MOVE_ATTACHMENT_BATCH_SIZE moved attachments (100), committed
+one by one, for at most ODOO_DEV_ATTACHMENT_TIME_BUDGET seconds: the rest
+is done at the next start. The other steps run in one transaction.
+"""
+from __future__ import print_function
+
+import configparser
+import hashlib
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+try:
+    import boto3
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    boto3 = None
+
+# set while the attachments are not all out of S3 or Swift
+CLEANUP_PARAMETER = 'dev_reset_db.attachment_cleanup'
+# where docker-compose.yml mounts the data-odoo volume
+DEFAULT_DATA_DIR = '/odoo/data/odoo'
+
+
+def _env_flag(name):
+    return os.environ.get(name, '').lower() == 'true'
+
+
+def connect(dbname):
+    params = {
+        'host': os.environ.get('DB_HOST'),
+        'port': os.environ.get('DB_PORT'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD'),
+    }
+    return psycopg2.connect(
+        dbname=dbname, **{key: value for key, value in params.items() if value}
+    )
+
+
+def _db_exists(db_name):
+    connection = connect('postgres')
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_database WHERE datname = %s', (db_name,)
+            )
+            return bool(cursor.fetchone())
+    finally:
+        connection.close()
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+def _data_dir():
+    """Return the data_dir of the Odoo configuration file (ODOO_RC)"""
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(os.environ.get('ODOO_RC', '/etc/odoo.cfg'))
+    data_dir = config.get('options', 'data_dir', fallback=None)
+    return data_dir or DEFAULT_DATA_DIR
+
+
+def attachment_cleanup_needed(cursor):
+    """Return whether attachments are on S3 or Swift or a cleanup is due"""
+    cursor.execute(
+        """
+        SELECT key, value FROM ir_config_parameter
+        WHERE key IN ('ir_attachment.location', %s)
+        """,
+        (CLEANUP_PARAMETER,),
+    )
+    parameters = dict(cursor.fetchall())
+    return (
+        parameters.get('ir_attachment.location') in ('s3', 'swift')
+        or CLEANUP_PARAMETER in parameters
+    )
+
+
+def reset_attachment_location(cursor):
+    """Store the new attachments in the database"""
+    cursor.execute(
+        """
+        UPDATE ir_config_parameter SET value = 'db'
+        WHERE key = 'ir_attachment.location'
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO ir_config_parameter (key, value) VALUES (%s, 'pending')
+        ON CONFLICT (key) DO NOTHING
+        """,
+        (CLEANUP_PARAMETER,),
+    )
+    return 'location set to db'
+
+
+def _run_batches(connection, label, select_sql, process, deadline, batch_size):
+    """Process the rows of ``select_sql`` by batches, committing each one.
+
+    ``select_sql`` selects ``(id, ...)`` rows with an id greater than its
+    first parameter, ordered by id, limited by its second parameter.
+
+    :return: whether all the rows were processed before the deadline
+    """
+    start = time.time()
+    last_id = done = 0
+    with connection.cursor() as cursor:
+        while True:
+            if deadline and time.time() > deadline:
+                print('{}: time budget exceeded, {} done'.format(label, done))
+                return False
+            cursor.execute(select_sql, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                print(
+                    '{}: {} done ({:.2f}s)'.format(
+                        label, done, time.time() - start
+                    )
+                )
+                return True
+            process(cursor, rows)
+            connection.commit()
+            last_id = rows[-1][0]
+            done += len(rows)
+            print(
+                '{}: {} done ({:.0f}/s)'.format(
+                    label, done, done / max(time.time() - start, 0.001)
+                )
+            )
+
+
+def delete_web_attachments(cursor, rows):
+    cursor.execute(
+        'DELETE FROM ir_attachment WHERE id = ANY(%s)',
+        ([row[0] for row in rows],),
+    )
+
+
+class S3Mover(object):
+    """Move the S3 attachments to the database or the filestore.
+
+    The objects of a batch are downloaded in parallel, the attachments are
+    updated once all of them are there. The objects which cannot be read
+    (no credentials, access denied...) are left on S3 and skipped.
+    """
+
+    SKIPPED = object()
+
+    def __init__(self, db_name, target):
+        self.target = target
+        self.filestore = os.path.join(_data_dir(), 'filestore', db_name)
+        self.client = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('AWS_HOST') or None,
+            region_name=os.environ.get('AWS_REGION') or None,
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=_env_int('ODOO_DEV_MOVE_ATTACHMENT_JOBS', 8)
+        )
+        self.missing = 0
+        self.skipped = 0
+
+    def _download(self, store_fname):
+        bucket, key = store_fname[len('s3://') :].split('/', 1)
+        try:
+            response = self.client.get_object(Bucket=bucket, Key=key)
+            return response['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+        except (BotoCoreError, ClientError) as e:
+            print('{} not moved: {}'.format(store_fname, e))
+            return self.SKIPPED
+
+    def _write_file(self, data):
+        checksum = hashlib.sha1(data).hexdigest()
+        fname = '{}/{}'.format(checksum[:2], checksum)
+        path = os.path.join(self.filestore, fname)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as stream:
+                stream.write(data)
+        return fname
+
+    def __call__(self, cursor, rows):
+        contents = self.executor.map(
+            self._download, [store_fname for __, store_fname in rows]
+        )
+        for (attachment_id, __), data in zip(rows, contents):
+            if data is self.SKIPPED:
+                self.skipped += 1
+            elif data is None:
+                # left as is, so it is not downloaded again and again
+                self.missing += 1
+                cursor.execute(
+                    """
+                    UPDATE ir_attachment
+                    SET store_fname = 'missing:' || store_fname
+                    WHERE id = %s
+                    """,
+                    (attachment_id,),
+                )
+            elif self.target == 'db':
+                cursor.execute(
+                    """
+                    UPDATE ir_attachment
+                    SET db_datas = %s, store_fname = NULL
+                    WHERE id = %s
+                    """,
+                    (psycopg2.Binary(data), attachment_id),
+                )
+            else:
+                cursor.execute(
+                    """
+                    UPDATE ir_attachment
+                    SET store_fname = %s, db_datas = NULL
+                    WHERE id = %s
+                    """,
+                    (self._write_file(data), attachment_id),
+                )
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def cleanup_attachments(connection, db_name):
+    """Delete the web attachments, move the S3 ones if asked.
+
+    :return: whether the cleanup is complete
+    """
+    budget = _env_int('ODOO_DEV_ATTACHMENT_TIME_BUDGET', 600)
+    deadline = time.time() + budget if budget else None
+    complete = _run_batches(
+        connection,
+        'web attachments deleted',
+        """
+        SELECT id FROM ir_attachment
+        WHERE id > %s AND url LIKE '/web/content/%%'
+        AND (store_fname LIKE 's3://%%' OR store_fname LIKE 'swift://%%')
+        ORDER BY id LIMIT %s
+        """,
+        delete_web_attachments,
+        deadline,
+        _env_int('ODOO_DEV_ATTACHMENT_BATCH_SIZE', 10000),
+    )
+    target = os.environ.get('ODOO_DEV_MOVE_ATTACHMENT_S3', '').lower()
+    if complete and target in ('db', 'file'):
+        if boto3 is None:
+            print('boto3 is not installed, S3 attachments are not moved')
+            return complete
+        mover = S3Mover(db_name, target)
+        try:
+            complete = _run_batches(
+                connection,
+                'S3 attachments moved to {}'.format(target),
+                """
+                SELECT id, store_fname FROM ir_attachment
+                WHERE id > %s AND store_fname LIKE 's3://%%'
+                ORDER BY id LIMIT %s
+                """,
+                mover,
+                deadline,
+                # a batch is held in memory and committed at once
+                _env_int('ODOO_DEV_MOVE_ATTACHMENT_BATCH_SIZE', 100),
+            )
+        finally:
+            mover.close()
+        if mover.missing:
+            print('{} attachments not found on S3'.format(mover.missing))
+        if mover.skipped:
+            print('{} attachments left on S3'.format(mover.skipped))
+    if complete:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM ir_config_parameter WHERE key = %s',
+                (CLEANUP_PARAMETER,),
+            )
+        connection.commit()
+    return complete
+
+
+def reset_passwords(cursor):
+    """Set the password of the users to their login"""
+    cursor.execute('UPDATE res_users SET password = login')
+    return '{} passwords reset'.format(cursor.rowcount)
+
+
+def reset_database_uuid(cursor):
+    """Set a new random database uuid"""
+    cursor.execute(
+        """
+        UPDATE ir_config_parameter SET value = %s
+        WHERE key = 'database.uuid'
+        """,
+        (str(uuid.uuid4()),),
+    )
+    return 'database uuid set'
+
+
+def get_steps(running_env):
+    """Return the steps to run for the environment, in order"""
+    steps = []
+    if running_env == 'dev':
+        steps.append(reset_passwords)
+    if running_env != 'prod' and not _env_flag('ODOO_KEEP_DATABASE_UUID'):
+        steps.append(reset_database_uuid)
+    return steps
+
+
+def main():
+    db_name = os.environ.get('DB_NAME')
+    running_env = os.environ.get('RUNNING_ENV')
+    steps = get_steps(running_env)
+    cleanup = running_env == 'dev' and not _env_flag(
+        'ODOO_DEV_KEEP_ATTACHMENT_S3'
+    )
+    if not db_name or not (steps or cleanup):
+        return 0
+    try:
+        connection = connect(db_name)
+    except psycopg2.OperationalError:
+        if not _db_exists(db_name):
+            print('Database does not exist, ignoring script')
+            return 0
+        raise
+    start = time.time()
+    try:
+        with connection.cursor() as cursor:
+            cleanup = cleanup and attachment_cleanup_needed(cursor)
+        if cleanup:
+            steps.insert(0, reset_attachment_location)
+        # the connection commits on success, rolls back on error
+        with connection, connection.cursor() as cursor:
+            for step in steps:
+                step_start = time.time()
+                message = step(cursor)
+                print(
+                    '{}: {} ({:.2f}s)'.format(
+                        step.__name__, message, time.time() - step_start
+                    )
+                )
+        if cleanup:
+            cleanup_attachments(connection, db_name)
+    finally:
+        connection.close()
+    print('Database reset in {:.2f}s'.format(time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright 2026 Kal-It
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""Run a Marabunta operation and record its duration.
+
+Usage: marabunta_step.py <version> <pre|post> <command> [args...]
+
+The duration of the command is recorded in the marabunta_step_timing
+table, next to marabunta_version, with its version and phase. The exit
+code of the command is returned unchanged; failing to record the timing
+only prints a warning, it never fails the migration.
+
+``invoke migrate.timings`` shows the history of the durations and
+estimates the runtime of the pending versions.
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+from dev_reset_db import connect
+
+TIMING_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS marabunta_step_timing (
+        id serial PRIMARY KEY,
+        version varchar NOT NULL,
+        phase varchar NOT NULL,
+        command text NOT NULL,
+        date_start timestamp NOT NULL,
+        duration numeric NOT NULL,
+        returncode integer NOT NULL
+    )
+"""
+
+
+def record(version, phase, command, date_start, duration, returncode):
+    connection = connect(os.environ['DB_NAME'])
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(TIMING_TABLE_SQL)
+            cursor.execute(
+                """
+                INSERT INTO marabunta_step_timing
+                (version, phase, command, date_start, duration, returncode)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                (version, phase, command, date_start, duration, returncode),
+            )
+    finally:
+        connection.close()
+
+
+def main(argv):
+    if len(argv) < 4:
+        print(__doc__)
+        return 2
+    version, phase, command = argv[1], argv[2], argv[3:]
+    date_start = datetime.utcnow()
+    start = time.time()
+    returncode = subprocess.call(command)
+    duration = time.time() - start
+    print(
+        'Version {} {} step done in {:.1f}s: {}'.format(
+            version, phase, duration, ' '.join(command)
+        )
+    )
+    try:
+        record(
+            version,
+            phase,
+            ' '.join(command),
+            date_start,
+            round(duration, 3),
+            returncode,
+        )
+    except (KeyError, psycopg2.Error) as e:
+        print('Timing of the step not recorded: {}'.format(e))
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,11 +1,11 @@
 {
     "name": "Gestion des étudiants",
-    "version": "0.7",
+    "version": "0.10",
     "category": "Generic Modules/Others",
     "description": """Test création module gestion des étudiants Odoo v14""",
     "author": "CHAREUN Maximilien",
-    "depends": ["base"],
+    "depends": ["base", "mail"],
     "installable": True,
     "auto_install": False,
-    "data": ["views/students_views.xml","views/training_views.xml","views/menu_views.xml"]
+    "data": ["security/ir.model.access.csv","data/ir_sequence_data.xml","data/ir_cron_data.xml","views/students_views.xml","views/training_views.xml","views/duplicate_views.xml","views/roster_job_views.xml","views/menu_views.xml"]
 }
\ No newline at end of file
@@ -0,0 +1,176 @@
+import codecs
+import csv
+import json
+import logging
+
+from odoo import http
+from odoo.http import request
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 1000
+
+
+def _iter_csv(stream):
+    reader = csv.DictReader(codecs.getreader("utf-8-sig")(stream))
+    for index, row in enumerate(reader, 1):
+        yield index, row
+
+
+def _iter_ndjson(stream):
+    for index, line in enumerate(codecs.getreader("utf-8-sig")(stream), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            row = {"_error": "Invalid JSON object"}
+        yield index, row
+
+
+def _split_errors(batch):
+    """Return the readable rows of a batch and the errors of the others."""
+    errors = [
+        {"row": index, "number": None, "error": row["_error"]}
+        for index, row in batch
+        if "_error" in row
+    ]
+    return [(i, row) for i, row in batch if "_error" not in row], errors
+
+
+class StudentsImport(http.Controller):
+    @http.route(
+        "/students/import",
+        type="http",
+        auth="user",
+        methods=["POST"],
+        csrf=False,
+    )
+    def import_students(self, file=None, fmt=None, batch_size=None, **kw):
+        """Upsert students from a CSV or NDJSON upload.
+
+        The file is either sent as the ``file`` part of a multipart form or
+        as the raw request body. Expected columns/keys are ``firstname``,
+        ``lastname`` and the optional ``number`` and ``training_code``;
+        rows without a number always create a new student.
+        Rows are read as a stream and committed every ``batch_size`` rows,
+        so the upload size does not matter.
+
+        The response is a JSON report with the counters and the errors of
+        each rejected row (``row`` is the 1-based data row/line index).
+        """
+        rows = self._read_rows(file, fmt)
+        if rows is None:
+            error = {"error": "Unknown format %s" % fmt}
+            return self._json_response(error, status=400)
+        batch_size = self._batch_size(batch_size)
+        if not batch_size:
+            error = {"error": "batch_size must be a positive integer"}
+            return self._json_response(error, status=400)
+
+        report = {"created": 0, "updated": 0, "unchanged": 0, "errors": []}
+        Student = request.env["students.student"]
+        for batch in split_every(batch_size, rows, list):
+            batch, errors = _split_errors(batch)
+            report["errors"] += errors
+            for result in self._import_batch(Student, batch):
+                for key, value in result.items():
+                    report[key] += value
+            request.env.cr.commit()
+        _logger.info(
+            "Students import: %(created)s created, %(updated)s updated, "
+            "%(unchanged)s unchanged",
+            report,
+        )
+        return self._json_response(report)
+
+    @http.route(
+        "/students/import/check",
+        type="http",
+        auth="user",
+        methods=["POST"],
+        csrf=False,
+    )
+    def check_students(self, file=None, fmt=None, batch_size=None, **kw):
+        """Report the rows of an upload that look like duplicates.
+
+        Takes the same upload as ``/students/import`` but writes nothing.
+        Each row is compared to the existing students sharing one of its
+        blocking keys and to the other rows of its batch; the rows which
+        cannot be read are reported in ``errors``.
+        """
+        rows = self._read_rows(file, fmt)
+        if rows is None:
+            error = {"error": "Unknown format %s" % fmt}
+            return self._json_response(error, status=400)
+        batch_size = self._batch_size(batch_size)
+        if not batch_size:
+            error = {"error": "batch_size must be a positive integer"}
+            return self._json_response(error, status=400)
+        duplicates = []
+        errors = []
+        Duplicate = request.env["students.duplicate"]
+        for batch in split_every(batch_size, rows, list):
+            batch, batch_errors = _split_errors(batch)
+            errors += batch_errors
+            duplicates += Duplicate._check_rows(batch)
+        report = {"duplicates": duplicates, "errors": errors}
+        return self._json_response(report)
+
+    def _batch_size(self, batch_size):
+        """Return the batch size of a request, None if it is invalid."""
+        try:
+            batch_size = int(batch_size or IMPORT_BATCH_SIZE)
+        except ValueError:
+            return None
+        return batch_size if batch_size >= 1 else None
+
+    def _read_rows(self, file, fmt):
+        """Return an iterator of ``(index, row)`` on the uploaded file."""
+        if file is not None:
+            stream, filename = file.stream, file.filename or ""
+        else:
+            stream, filename = request.httprequest.stream, ""
+        if not fmt:
+            content_type = request.httprequest.mimetype or ""
+            ndjson = filename.endswith((".ndjson", ".jsonl"))
+            if ndjson or "ndjson" in content_type:
+                fmt = "ndjson"
+            else:
+                fmt = "csv"
+        if fmt == "csv":
+            return _iter_csv(stream)
+        if fmt == "ndjson":
+            return _iter_ndjson(stream)
+        return None
+
+    def _import_batch(self, Student, batch):
+        """Import a batch, falling back to row by row if the batch fails."""
+        try:
+            with request.env.cr.savepoint():
+                return [Student._import_batch(batch)]
+        except Exception:
+            _logger.info("Students import batch failed, retrying row by row")
+            request.env.clear()
+        results = []
+        for index, row in batch:
+            try:
+                with request.env.cr.savepoint():
+                    results.append(Student._import_batch([(index, row)]))
+            except Exception as e:
+                request.env.clear()
+                error = {"row": index, "number": row.get("number")}
+                error["error"] = str(e)
+                results.append({"errors": [error]})
+        return results
+
+    def _json_response(self, data, status=200):
+        response = request.make_response(
+            json.dumps(data), headers=[("Content-Type", "application/json")]
+        )
+        response.status_code = status
+        return response
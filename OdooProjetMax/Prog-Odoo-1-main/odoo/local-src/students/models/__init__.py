@@ -1 +1 @@
-from . import students
\ No newline at end of file
+from . import students, student_duplicate, roster_job
@@ -0,0 +1,137 @@
+import base64
+import csv
+import io
+import logging
+import time
+
+from odoo import api, fields, models
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+PREFETCH_SIZE = 1000
+# a cron run stops taking new jobs after that and triggers itself again
+CRON_TIME_BUDGET = 60
+# the cron records processing the jobs in parallel
+ROSTER_CRONS = [
+    "students.ir_cron_students_roster_jobs",
+    "students.ir_cron_students_roster_jobs_2",
+    "students.ir_cron_students_roster_jobs_3",
+    "students.ir_cron_students_roster_jobs_4",
+]
+
+
+class StudentsRosterJob(models.Model):
+    _name = "students.roster.job"
+    _inherit = ["mail.thread"]
+    _description = "Roster generation job"
+    _order = "id desc"
+
+    training_id = fields.Many2one(
+        "students.training", required=True, ondelete="cascade"
+    )
+    user_id = fields.Many2one(
+        "res.users", required=True, default=lambda self: self.env.user
+    )
+    state = fields.Selection(
+        [
+            ("pending", "Pending"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        index=True,
+    )
+    attachment_id = fields.Many2one("ir.attachment", readonly=True)
+    error = fields.Text(readonly=True)
+    date_done = fields.Datetime(readonly=True)
+
+    @api.model
+    def _enqueue(self, trainings):
+        """Create one job per training and wake the roster crons up."""
+        jobs = self.create([{"training_id": t.id} for t in trainings])
+        self._trigger_crons(len(jobs))
+        return jobs
+
+    @api.model
+    def _trigger_crons(self, count=len(ROSTER_CRONS)):
+        """Wake up to ``count`` roster crons, one per job to process."""
+        for xmlid in ROSTER_CRONS[:count]:
+            cron = self.env.ref(xmlid, raise_if_not_found=False)
+            if cron and cron.active:
+                cron._trigger()
+
+    @api.model
+    def _claim(self):
+        """Take the next pending job, skipping the ones being processed."""
+        self.env.cr.execute(
+            "SELECT id FROM students_roster_job WHERE state = 'pending' "
+            "ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED"
+        )
+        row = self.env.cr.fetchone()
+        return self.browse(row[0] if row else [])
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Process the pending jobs, committing after each one.
+
+        Jobs are claimed with ``SKIP LOCKED``, so the ROSTER_CRONS records
+        calling this method run in parallel cron workers without taking
+        the same training twice.
+        """
+        start = time.time()
+        while time.time() - start < CRON_TIME_BUDGET:
+            job = self._claim()
+            if not job:
+                return True
+            job.state = "running"
+            try:
+                with self.env.cr.savepoint():
+                    job._generate()
+            except Exception as e:
+                _logger.exception("Roster job %s failed", job.id)
+                job.write({"state": "failed", "error": str(e)})
+            self.env.cr.commit()
+        self._trigger_crons()
+        return True
+
+    def _generate(self):
+        self.ensure_one()
+        Student = self.env["students.student"]
+        student_ids = Student.search(
+            [("training_id", "=", self.training_id.id)],
+            order="lastname, firstname, number",
+        ).ids
+        output = io.StringIO()
+        writer = csv.writer(output)
+        fnames = ["number", "lastname", "firstname"]
+        writer.writerow(fnames)
+        for ids in split_every(PREFETCH_SIZE, student_ids):
+            for student in Student.browse(ids).read(fnames):
+                writer.writerow([student[fname] for fname in fnames])
+            # keep the memory bounded on trainings with many students
+            Student.invalidate_cache(ids=list(ids))
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": "roster_%s.csv" % self.training_id.code,
+                "datas": base64.b64encode(output.getvalue().encode("utf-8")),
+                "mimetype": "text/csv",
+                "res_model": self._name,
+                "res_id": self.id,
+            }
+        )
+        self.write(
+            {
+                "state": "done",
+                "attachment_id": attachment.id,
+                "date_done": fields.Datetime.now(),
+            }
+        )
+        self.message_post(
+            body="Roster of %s is ready (%s students)."
+            % (self.training_id.code, len(student_ids)),
+            attachment_ids=attachment.ids,
+            partner_ids=self.user_id.partner_id.ids,
+        )
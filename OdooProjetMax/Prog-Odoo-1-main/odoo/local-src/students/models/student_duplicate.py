@@ -0,0 +1,199 @@
+import logging
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from itertools import combinations
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# blocks bigger than that are too generic to be useful ("martin|j")
+MAX_BLOCK_SIZE = 500
+NUMBER_PREFIX_SIZE = 9
+NAME_THRESHOLD = 0.85
+FETCH_SIZE = 10000
+
+
+def normalize(value):
+    """Return the lowercased ascii tokens of a name."""
+    value = unicodedata.normalize("NFKD", str(value or ""))
+    value = "".join(c for c in value if not unicodedata.combining(c)).lower()
+    return "".join(c if c.isalnum() else " " for c in value).split()
+
+
+def name_key(firstname, lastname):
+    """Blocking key of a name: its last name and its first name initial."""
+    first, last = normalize(firstname), normalize(lastname)
+    if not last:
+        return False
+    return "%s|%s" % ("".join(last), first[0][0] if first else "")
+
+
+def blocking_keys(firstname, lastname, number):
+    """Return the blocks a student belongs to.
+
+    A student is compared only to the students sharing one of its blocks:
+    same name key, same name key with first and last names swapped, or
+    same number prefix.
+    """
+    keys = {name_key(firstname, lastname), name_key(lastname, firstname)}
+    number = str(number or "").strip()
+    if len(number) > NUMBER_PREFIX_SIZE:
+        keys.add("#%s" % number[:NUMBER_PREFIX_SIZE])
+    keys.discard(False)
+    return keys
+
+
+def similarity(student, other):
+    """Return ``(score, reason)`` for two ``(firstname, lastname, number)``."""
+    name = " ".join(normalize(student[0]) + normalize(student[1]))
+    other_name = " ".join(normalize(other[0]) + normalize(other[1]))
+    swapped_name = " ".join(normalize(other[1]) + normalize(other[0]))
+    score = max(
+        SequenceMatcher(None, name, other_name).ratio(),
+        SequenceMatcher(None, name, swapped_name).ratio(),
+    )
+    if student[2] and student[2] == other[2]:
+        return 1.0, "number"
+    return score, "name"
+
+
+def find_candidates(students, threshold=NAME_THRESHOLD):
+    """Yield ``(id, other_id, score, reason)`` for likely duplicates.
+
+    ``students`` is an iterable of ``(id, firstname, lastname, number)``.
+    Pairs are only compared inside their blocks, so the cost is linear in
+    the number of students as long as blocks stay small.
+    """
+    data = {}
+    blocks = defaultdict(list)
+    for student_id, firstname, lastname, number in students:
+        data[student_id] = (firstname, lastname, number)
+        for key in blocking_keys(firstname, lastname, number):
+            blocks[key].append(student_id)
+    seen = set()
+    for key, ids in blocks.items():
+        if len(ids) > MAX_BLOCK_SIZE:
+            _logger.info(
+                "Skipping duplicate block %s of %s students", key, len(ids)
+            )
+            continue
+        for pair in combinations(sorted(ids), 2):
+            if pair in seen:
+                continue
+            seen.add(pair)
+            score, reason = similarity(data[pair[0]], data[pair[1]])
+            if score >= threshold:
+                yield pair[0], pair[1], score, reason
+
+
+class StudentsDuplicate(models.Model):
+    _name = "students.duplicate"
+    _description = "Student merge candidate"
+    _order = "score desc, id"
+
+    student_id = fields.Many2one(
+        "students.student", required=True, ondelete="cascade"
+    )
+    duplicate_id = fields.Many2one(
+        "students.student", required=True, ondelete="cascade"
+    )
+    score = fields.Float(digits=(3, 2))
+    reason = fields.Selection(
+        [("number", "Same number"), ("name", "Similar name")]
+    )
+
+    @api.model
+    def _iter_students(self):
+        """Stream all the students with a server-side cursor."""
+        self.env["students.student"].flush()
+        cr = self.env.cr
+        cr.execute(
+            "DECLARE students_dedup NO SCROLL CURSOR FOR "
+            "SELECT id, firstname, lastname, number FROM students_student"
+        )
+        while True:
+            cr.execute("FETCH %s FROM students_dedup", (FETCH_SIZE,))
+            rows = cr.fetchall()
+            if not rows:
+                break
+            yield from rows
+        cr.execute("CLOSE students_dedup")
+
+    @api.model
+    def _cron_find_duplicates(self, threshold=NAME_THRESHOLD):
+        """Replace the merge candidates by a fresh detection."""
+        candidates = [
+            {
+                "student_id": student_id,
+                "duplicate_id": other_id,
+                "score": score,
+                "reason": reason,
+            }
+            for student_id, other_id, score, reason in find_candidates(
+                self._iter_students(), threshold=threshold
+            )
+        ]
+        self.search([]).unlink()
+        self.create(candidates)
+        _logger.info("%s student merge candidates found", len(candidates))
+        return True
+
+    @api.model
+    def _check_rows(self, rows, threshold=NAME_THRESHOLD):
+        """Find the existing students an import would duplicate.
+
+        ``rows`` is a list of ``(row_index, row_dict)``. Only the students
+        sharing a name block with the rows are read, using the indexed
+        ``dedup_key``; rows are also compared between themselves.
+
+        :return: a list of ``{"row", "number", "duplicate_of", "score"}``
+        """
+        keys = set()
+        for __, row in rows:
+            firstname, lastname = row.get("firstname"), row.get("lastname")
+            keys |= blocking_keys(firstname, lastname, "")
+        existing = self.env["students.student"].search_read(
+            [("dedup_key", "in", list(keys))],
+            ["firstname", "lastname", "number"],
+        )
+        # existing students are keyed by id, rows by negative index
+        students = [
+            (s["id"], s["firstname"], s["lastname"], s["number"])
+            for s in existing
+        ]
+        students += [
+            (
+                -index,
+                row.get("firstname"),
+                row.get("lastname"),
+                row.get("number"),
+            )
+            for index, row in rows
+        ]
+        numbers = {s["id"]: s["number"] for s in existing}
+        numbers.update({-index: row.get("number") for index, row in rows})
+        result = []
+        for student_id, other_id, score, reason in find_candidates(
+            students, threshold=threshold
+        ):
+            if student_id > 0 and other_id > 0:
+                continue
+            if reason == "number":
+                # same number: the import updates the student
+                continue
+            row_id, other_id = sorted((student_id, other_id))
+            if other_id > 0:
+                duplicate_of = numbers[other_id]
+            else:
+                duplicate_of = "row %s" % -other_id
+            result.append(
+                {
+                    "row": -row_id,
+                    "number": numbers[row_id],
+                    "duplicate_of": duplicate_of,
+                    "score": round(score, 2),
+                }
+            )
+        return result
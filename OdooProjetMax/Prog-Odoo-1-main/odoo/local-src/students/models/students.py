@@ -1,4 +1,11 @@
-from odoo import fields, models
+from odoo import api, fields, models, tools
+
+from .student_duplicate import name_key
+
+IMPORT_FIELDS = ("firstname", "lastname")
+NEW_NUMBER = "/"
+
+
 class StudentsTraining(models.Model):
     _name = "students.training"
     _description = "Training table"
@@ -11,15 +18,221 @@ class StudentsTraining(models.Model):
         comodel_name="students.student",
         inverse_name="training_id",
     )
+
+    @api.model
+    @tools.ormcache()
+    def _get_display_names(self):
+        """Return ``{id: display name}`` for all the trainings.
+
+        There are only a few hundred trainings, so one query fills the
+        cache of the worker for every student list and many2one.
+        """
+        self.flush(["code"])
+        self.env.cr.execute("SELECT id, code FROM students_training")
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    @tools.ormcache(
+        "self.env.uid",
+        "self.env.context.get('active_test', True)",
+        "self.env.lang",
+        "name",
+        "operator",
+        "limit",
+    )
+    def _name_search_cached(self, name, operator, limit):
+        # the results depend on the context through active_test and lang
+        return super().name_search(name=name, operator=operator, limit=limit)
+
+    def name_get(self):
+        names = self._get_display_names()
+        if not all(training_id in names for training_id in self.ids):
+            # new or not yet flushed records
+            return super().name_get()
+        return [(training.id, names[training.id]) for training in self]
+
+    @api.model
+    def name_search(self, name="", args=None, operator="ilike", limit=100):
+        if args:
+            return super().name_search(
+                name=name, args=args, operator=operator, limit=limit
+            )
+        return list(self._name_search_cached(name, operator, limit))
+
+    def action_generate_roster(self):
+        """Queue the roster generation of the trainings in background."""
+        jobs = self.env["students.roster.job"]._enqueue(self)
+        action = self.env["ir.actions.actions"]._for_xml_id(
+            "students.action_students_roster_job_view"
+        )
+        action["domain"] = [("id", "in", jobs.ids)]
+        return action
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "code" in vals:
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+
 class StudentsStudent(models.Model):
     _name = "students.student"
     _description = "Student table"
 
-    number = fields.Char("Student number", size=11, required=True)
+    number = fields.Char(
+        "Student number",
+        size=11,
+        required=True,
+        copy=False,
+        default=NEW_NUMBER,
+    )
     firstname = fields.Char("Student firstname", size=64, required=True)
     lastname = fields.Char("Student lastname", size=64, required=True)
     training_id = fields.Many2one(
         string="Training",
         comodel_name="students.training",
         ondelete="cascade",
-    )
\ No newline at end of file
+    )
+    dedup_key = fields.Char(
+        compute="_compute_dedup_key", store=True, index=True
+    )
+
+    _sql_constraints = [
+        ("number_uniq", "unique(number)", "The student number must be unique.")
+    ]
+
+    @api.depends("firstname", "lastname")
+    def _compute_dedup_key(self):
+        for student in self:
+            student.dedup_key = name_key(student.firstname, student.lastname)
+
+    @api.model
+    def _allocate_numbers(self, count):
+        """Reserve ``count`` student numbers in a single query.
+
+        The numbers come straight from the PostgreSQL sequence of the
+        ``standard`` ir.sequence: concurrent transactions never wait on
+        each other and never get the same number (gaps are accepted).
+        """
+        sequence = self.env.ref("students.seq_students_student_number").sudo()
+        self.env.cr.execute(
+            "SELECT nextval(%s) FROM generate_series(1, %s)",
+            ("ir_sequence_%03d" % sequence.id, count),
+        )
+        return [
+            sequence.get_next_char(number)
+            for number, in self.env.cr.fetchall()
+        ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        to_number = [
+            vals
+            for vals in vals_list
+            if vals.get("number", NEW_NUMBER) in (NEW_NUMBER, False, "")
+        ]
+        if to_number:
+            numbers = self._allocate_numbers(len(to_number))
+            for vals, number in zip(to_number, numbers):
+                vals["number"] = number
+        return super().create(vals_list)
+
+    @api.model
+    def _import_check_row(self, row, training_ids):
+        """Return the values to write for an import row, or an error."""
+        vals = {}
+        for fname in ("number",) + IMPORT_FIELDS:
+            value = str(row.get(fname) or "").strip()
+            if not value:
+                if fname == "number":
+                    continue
+                return None, "Missing value for '%s'" % fname
+            size = self._fields[fname].size
+            if len(value) > size:
+                error = "'%s' is longer than %s characters" % (fname, size)
+                return None, error
+            vals[fname] = value
+        code = str(row.get("training_code") or "").strip()
+        if code:
+            if code not in training_ids:
+                return None, "Unknown training code '%s'" % code
+            vals["training_id"] = training_ids[code]
+        return vals, None
+
+    @api.model
+    def _import_batch(self, rows):
+        """Upsert a batch of import rows on their ``number``.
+
+        ``rows`` is a list of ``(row_index, row_dict)``. Rows without a
+        number are created with a newly allocated one. Training codes are
+        resolved and existing students are fetched with one query each for
+        the whole batch; students whose values did not change are not
+        written.
+
+        :return: a dict of counters and the list of per-row errors
+        """
+        result = {"created": 0, "updated": 0, "unchanged": 0, "errors": []}
+        codes = {
+            str(row.get("training_code") or "").strip() for __, row in rows
+        }
+        codes.discard("")
+        training_ids = {}
+        if codes:
+            trainings = self.env["students.training"].search_read(
+                [("code", "in", list(codes))], ["code"], order="id desc"
+            )
+            training_ids = {t["code"]: t["id"] for t in trainings}
+
+        pending = {}
+        to_create = []
+        for index, row in rows:
+            vals, error = self._import_check_row(row, training_ids)
+            if error:
+                result["errors"].append(
+                    {"row": index, "number": row.get("number"), "error": error}
+                )
+                continue
+            if "number" not in vals:
+                to_create.append(vals)
+                continue
+            # the last occurrence of a number in the batch wins
+            pending.setdefault(vals["number"], {}).update(vals)
+
+        existing = self.browse()
+        if pending:
+            existing = self.search([("number", "in", list(pending))])
+        for student in existing:
+            if student.number not in pending:
+                continue
+            vals = pending.pop(student.number)
+            current = {
+                "firstname": student.firstname,
+                "lastname": student.lastname,
+                "training_id": student.training_id.id,
+            }
+            changes = {
+                fname: value
+                for fname, value in vals.items()
+                if fname in current and current[fname] != value
+            }
+            if changes:
+                student.write(changes)
+                result["updated"] += 1
+            else:
+                result["unchanged"] += 1
+        to_create += pending.values()
+        if to_create:
+            self.create(to_create)
+            result["created"] += len(to_create)
+        return result
@@ -0,0 +1 @@
+from . import test_duplicate, test_import, test_numbers
@@ -0,0 +1,95 @@
+from odoo.tests.common import BaseCase, SavepointCase
+
+from ..models.student_duplicate import blocking_keys, find_candidates, name_key
+
+
+class TestDuplicateKeys(BaseCase):
+    def test_name_key(self):
+        self.assertEqual(name_key("Élodie", "Le Gall"), "legall|e")
+        self.assertEqual(name_key("", "Martin"), "martin|")
+        self.assertFalse(name_key("Jean", " "))
+
+    def test_blocking_keys(self):
+        self.assertEqual(
+            blocking_keys("Jean", "Martin", "20240000123"),
+            {"martin|j", "jean|m", "#202400001"},
+        )
+        self.assertEqual(
+            blocking_keys("Jean", "Martin", "1234"), {"martin|j", "jean|m"}
+        )
+
+    def test_swapped_names(self):
+        candidates = list(
+            find_candidates(
+                [
+                    (1, "Jean", "Martin", "20240000001"),
+                    (2, "Martin", "Jean", "20240000002"),
+                    (3, "Paul", "Durand", "20240000003"),
+                ]
+            )
+        )
+        self.assertEqual(candidates, [(1, 2, 1.0, "name")])
+
+    def test_same_number(self):
+        candidates = list(
+            find_candidates(
+                [
+                    (1, "Jean", "Martin", "20240000001"),
+                    (2, "Marie", "Curie", "20240000001"),
+                ]
+            )
+        )
+        self.assertEqual(candidates, [(1, 2, 1.0, "number")])
+
+
+class TestCheckRows(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Duplicate = cls.env["students.duplicate"]
+        cls.student = cls.env["students.student"].create(
+            {
+                "number": "20240000001",
+                "firstname": "Jean",
+                "lastname": "Martin",
+            }
+        )
+
+    def test_swapped_names(self):
+        rows = [(1, {"number": "", "firstname": "Martin", "lastname": "Jean"})]
+        self.assertEqual(
+            self.Duplicate._check_rows(rows),
+            [
+                {
+                    "row": 1,
+                    "number": "",
+                    "duplicate_of": "20240000001",
+                    "score": 1.0,
+                }
+            ],
+        )
+
+    def test_same_number(self):
+        # the import updates the student
+        rows = [
+            (
+                1,
+                {
+                    "number": "20240000001",
+                    "firstname": "Jean",
+                    "lastname": "Martin",
+                },
+            )
+        ]
+        self.assertEqual(self.Duplicate._check_rows(rows), [])
+
+    def test_between_rows(self):
+        rows = [
+            (1, {"number": "", "firstname": "Paul", "lastname": "Durand"}),
+            (2, {"number": "", "firstname": "Paul", "lastname": "Durand"}),
+            (3, {"number": "", "firstname": "Marie", "lastname": "Curie"}),
+        ]
+        result = self.Duplicate._check_rows(rows)
+        self.assertEqual(
+            [(r["row"], r["duplicate_of"]) for r in result], [(2, "row 1")]
+        )
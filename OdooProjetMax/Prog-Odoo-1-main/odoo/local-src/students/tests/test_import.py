@@ -0,0 +1,122 @@
+from odoo.tests.common import SavepointCase
+
+
+class TestImport(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Student = cls.env["students.student"]
+        cls.training = cls.env["students.training"].create(
+            {"code": "INF1", "name": "Informatique"}
+        )
+        cls.student = cls.Student.create(
+            {
+                "number": "20240000001",
+                "firstname": "Jean",
+                "lastname": "Martin",
+            }
+        )
+
+    def test_same_number_updates(self):
+        result = self.Student._import_batch(
+            [
+                (
+                    1,
+                    {
+                        "number": "20240000001",
+                        "firstname": "Jean",
+                        "lastname": "Dupont",
+                        "training_code": "INF1",
+                    },
+                )
+            ]
+        )
+        self.assertEqual(
+            result,
+            {"created": 0, "updated": 1, "unchanged": 0, "errors": []},
+        )
+        self.assertEqual(self.student.lastname, "Dupont")
+        self.assertEqual(self.student.training_id, self.training)
+
+    def test_unchanged(self):
+        result = self.Student._import_batch(
+            [
+                (
+                    1,
+                    {
+                        "number": "20240000001",
+                        "firstname": "Jean",
+                        "lastname": "Martin",
+                    },
+                )
+            ]
+        )
+        self.assertEqual(result["unchanged"], 1)
+        self.assertEqual(result["updated"], 0)
+
+    def test_last_occurrence_wins(self):
+        number = "20240000002"
+        result = self.Student._import_batch(
+            [
+                (1, {"number": number, "firstname": "A", "lastname": "B"}),
+                (2, {"number": number, "firstname": "C", "lastname": "D"}),
+            ]
+        )
+        self.assertEqual(result["created"], 1)
+        student = self.Student.search([("number", "=", number)])
+        self.assertEqual((student.firstname, student.lastname), ("C", "D"))
+
+    def test_errors(self):
+        result = self.Student._import_batch(
+            [
+                (1, {"number": "20240000003", "firstname": "Paul"}),
+                (
+                    2,
+                    {
+                        "number": "20240000004",
+                        "firstname": "x" * 65,
+                        "lastname": "Durand",
+                    },
+                ),
+                (
+                    3,
+                    {
+                        "number": "20240000005",
+                        "firstname": "Marie",
+                        "lastname": "Curie",
+                        "training_code": "XXX",
+                    },
+                ),
+                (
+                    4,
+                    {
+                        "number": "20240000006",
+                        "firstname": "Ada",
+                        "lastname": "Byron",
+                    },
+                ),
+            ]
+        )
+        self.assertEqual(result["created"], 1)
+        self.assertEqual(
+            result["errors"],
+            [
+                {
+                    "row": 1,
+                    "number": "20240000003",
+                    "error": "Missing value for 'lastname'",
+                },
+                {
+                    "row": 2,
+                    "number": "20240000004",
+                    "error": "'firstname' is longer than 64 characters",
+                },
+                {
+                    "row": 3,
+                    "number": "20240000005",
+                    "error": "Unknown training code 'XXX'",
+                },
+            ],
+        )
+        numbers = ["20240000003", "20240000004", "20240000005"]
+        self.assertFalse(self.Student.search([("number", "in", numbers)]))
@@ -0,0 +1,42 @@
+from odoo.tests.common import SavepointCase
+
+
+class TestNumbers(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Student = cls.env["students.student"]
+
+    def test_allocate_numbers(self):
+        numbers = self.Student._allocate_numbers(3)
+        self.assertEqual(len(set(numbers)), 3)
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertTrue(all(len(number) == 11 for number in numbers))
+
+    def test_create_numbers(self):
+        students = self.Student.create(
+            [
+                {"firstname": "Paul", "lastname": "Durand"},
+                {"number": "/", "firstname": "Marie", "lastname": "Curie"},
+                {"number": "20240000009", "firstname": "Ada", "lastname": "B"},
+            ]
+        )
+        numbers = students.mapped("number")
+        self.assertEqual(len(set(numbers)), 3)
+        self.assertNotIn("/", numbers)
+        self.assertEqual(numbers[2], "20240000009")
+
+    def test_rows_without_number(self):
+        result = self.Student._import_batch(
+            [
+                (1, {"number": "", "firstname": "Paul", "lastname": "Durand"}),
+                (2, {"firstname": "Marie", "lastname": "Curie"}),
+            ]
+        )
+        self.assertEqual(result["created"], 2)
+        students = self.Student.search(
+            [("lastname", "in", ["Durand", "Curie"])]
+        )
+        self.assertEqual(len(students), 2)
+        self.assertEqual(len(set(students.mapped("number"))), 2)
+        self.assertNotIn("/", students.mapped("number"))
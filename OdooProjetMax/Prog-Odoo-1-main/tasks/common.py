@@ -5,9 +5,13 @@
 from __future__ import print_function
 
 import errno
+import hashlib
+import json
 import os
 import shutil
+import sys
 import tempfile
+import time
 from builtins import input
 from contextlib import contextmanager
 
@@ -47,6 +51,88 @@ TEMPLATE_GIT_REPO_URL = 'git@github.com:{}.git'
 TEMPLATE_GIT = TEMPLATE_GIT_REPO_URL.format('camptocamp/odoo-template')
 
 
+def cache_path(*names):
+    """Return a path in the user cache directory of this project.
+
+    The directory is created when missing. It is specific to the project
+    checkout, so several projects don't share their cached data.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    project = '{}-{}'.format(
+        os.path.basename(root_path()),
+        hashlib.sha1(root_path().encode('utf-8')).hexdigest()[:8],
+    )
+    path = os.path.join(base, 'odoo-tasks', project, *names)
+    make_dir(os.path.dirname(path))
+    return path
+
+
+def print_json(data):
+    """Print data as JSON, dates and other objects as strings."""
+    print(json.dumps(data, indent=2, sort_keys=True, default=str))
+
+
+def human_size(size):
+    """Return a size in bytes as a human readable string"""
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if abs(size) < 1024 or unit == 'TB':
+            break
+        size /= 1024.0
+    return '{:.1f} {}'.format(size, unit)
+
+
+class TransferProgress(object):
+    """Print the amount of data processed and the throughput.
+
+    ``update`` and ``add`` may be called as often as needed, the line is
+    refreshed at most every ``interval`` seconds. ``initial`` is the amount
+    already processed before (e.g. resumed), not counted in the throughput.
+    """
+
+    def __init__(self, label, total=None, interval=1.0, initial=0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.initial = initial
+        self.done = initial
+        self.start = time.time()
+        self._printed = 0
+
+    def add(self, size):
+        self.update(self.done + size)
+
+    def update(self, done):
+        self.done = done
+        now = time.time()
+        if now - self._printed < self.interval:
+            return
+        self._printed = now
+        line = '{}: {}'.format(self.label, human_size(self.done))
+        if self.total:
+            line += ' / {} ({:.0%})'.format(
+                human_size(self.total), float(self.done) / self.total
+            )
+        line += ' at {}/s'.format(human_size(self.rate()))
+        sys.stdout.write('\r' + line.ljust(79))
+        sys.stdout.flush()
+
+    def rate(self):
+        elapsed = max(time.time() - self.start, 0.001)
+        return (self.done - self.initial) / elapsed
+
+    def finish(self):
+        """Print the final size and throughput"""
+        sys.stdout.write('\r' + ' ' * 79 + '\r')
+        print(
+            '{}: {} in {:.1f}s ({}/s)'.format(
+                self.label,
+                human_size(self.done),
+                time.time() - self.start,
+                human_size(self.rate()),
+            )
+        )
+
+
 def gpg_decrypt_to_file(ctx, password, file_name):
     """Get a value from lastpass.
     :param password: password to decript gpg file
@@ -3,85 +3,265 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 from __future__ import print_function
 
+import atexit
 import getpass
+import hashlib
+import io
 import json
 import os
+import re
+import subprocess
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime
 
 import gnupg
 import psycopg2
 import requests
-from invoke import task
+from invoke import exceptions, task
+from psycopg2.extras import execute_values
+from psycopg2.sql import SQL, Identifier, Literal
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
 
 from .common import (
+    TransferProgress,
+    cache_path,
     cd,
     cookiecutter_context,
     exit_msg,
     get_from_lastpass,
     gpg_decrypt_to_file,
+    human_size,
     make_dir,
+    print_json,
 )
 
 LPASS_GPG_DUMP_KEY_ID = 5794282849981145008
 base_s3_dump_path = "s3://odoo-dumps"
+DUMP_BAG_KEYS_URL = 'https://dump-bag.odoo.camptocamp.ch/keys'
+# the keys are downloaded again after this delay (seconds)
+DUMP_BAG_KEYS_TTL = 24 * 3600
+STREAM_BLOCK_SIZE = 1024 * 1024
+# seconds to wait for PostgreSQL to accept connections
+DB_READY_TIMEOUT = 30
+DUMP_BAG_BUCKET = 'odoo-dumps'
+DUMP_BAG_PROFILE = 'odoo-dumps'
+# S3 parts are uploaded UPLOAD_CONCURRENCY at a time, so an upload holds
+# at most (UPLOAD_CONCURRENCY + 1) * UPLOAD_PART_SIZE bytes in memory
+UPLOAD_PART_SIZE = 32 * 1024 * 1024
+UPLOAD_CONCURRENCY = 4
+# ranges downloaded in parallel for objects not uploaded in parts
+DOWNLOAD_PART_SIZE = 64 * 1024 * 1024
+DOWNLOAD_CONCURRENCY = 8
+# the dump lists are cached for that long
+DUMP_LIST_TTL = 10 * 60
+DUMP_DATE_RE = re.compile(r'(\d{8})-?(\d{6})')
+
+
+# state of the DB container for the whole invoke session
+_db_container = {'port': None}
+
+
+def _db_ready_timeout(ctx):
+    """Seconds to wait for PostgreSQL, from the invoke configuration
+
+    e.g. in invoke.yaml::
+
+        database:
+          ready_timeout: 60
+    """
+    database_config = ctx.config.get('database') or {}
+    return float(database_config.get('ready_timeout', DB_READY_TIMEOUT))
+
+
+def _stop_db_container(ctx):
+    print('Stopping the DB container')
+    ctx.run('docker-compose stop db', hide=True)
+
+
+def wait_for_db(ctx, timeout):
+    """Wait until PostgreSQL accepts connections in the DB container.
+
+    A published port only means the container runs, so the readiness is
+    checked by an actual connection, retried with an exponential backoff.
+
+    :param timeout: seconds after which to give up
+    :return: the port of the DB container
+    """
+    deadline = time.time() + timeout
+    delay = 0.05
+    port = None
+    not_ready = (exceptions.Failure, ValueError, psycopg2.OperationalError)
+    while True:
+        try:
+            if port is None:
+                port = _get_db_container_published_port(ctx)
+            remaining = max(int(deadline - time.time()), 1)
+            psycopg2.connect(
+                "host=localhost dbname=postgres user=odoo password=odoo "
+                "port=%s connect_timeout=%s" % (port, remaining)
+            ).close()
+            return port
+        except not_ready as e:
+            if time.time() + delay > deadline:
+                exit_msg(
+                    'DB container not ready after {}s: {}'.format(timeout, e)
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
 
 
 @contextmanager
 def ensure_db_container_up(ctx):
-    """ Ensure the DB container is up and running.
+    """ Ensure the DB container is up and accepting connections.
+
+    The container is checked once per invoke session. When it had to be
+    started, it is stopped at the end of the session rather than at the
+    end of the block, so a task with several steps starts PostgreSQL at
+    most once.
 
     :param ctx:
-    :return: True if already up, False if it wasn't
     """
-    try:
-        ctx.run('docker-compose port db 5432', hide=True)
-        started = True
-    except Exception:
-        ctx.run('docker-compose up -d db', hide=True)
-        running = False
-        # Wait for the container to start
-        count = 0
-        while not running:
-            try:
-                ctx.run('docker-compose port db 5432', hide=True)
-                running = True
-            except Exception as e:
-                count += 1
-                # Raise the error after 3 failed attempts
-                if count >= 3:
-                    raise e
-                print('Waiting for DB container to start')
-                time.sleep(0.3)
-        started = False
+    if _db_container['port'] is None:
+        try:
+            ctx.run('docker-compose port db 5432', hide=True)
+        except exceptions.Failure:
+            print('Starting the DB container')
+            ctx.run('docker-compose up -d db', hide=True)
+            atexit.register(_stop_db_container, ctx)
+        _db_container['port'] = wait_for_db(ctx, _db_ready_timeout(ctx))
     yield
-    # Stop the container if it wasn't already up and running
-    if not started:
-        ctx.run('docker-compose stop db', hide=True)
 
 
-def get_db_container_port(ctx):
-    """Get and return DB container port"""
+def _get_db_container_published_port(ctx):
     run_res = ctx.run('docker-compose port db 5432', hide=True)
     return str(int(run_res.stdout.split(':')[-1]))
 
 
-def get_db_request_result(ctx, dbname, sql):
-    """Return the execution of given SQL request on given db"""
-    result = False
-    with ensure_db_container_up(ctx):
-        db_port = get_db_container_port(ctx)
-        dsn = "host=localhost dbname=%s " "user=odoo password=odoo port=%s" % (
+def get_db_container_port(ctx):
+    """Get and return DB container port"""
+    if _db_container['port'] is None:
+        return _get_db_container_published_port(ctx)
+    return _db_container['port']
+
+
+class DBConnections(object):
+    """Connections to the databases of the DB container.
+
+    The container port is resolved once and the connections are kept open
+    per database name, in autocommit. A connection is handed out to one
+    user at a time, so the pool can be shared between threads.
+    """
+
+    def __init__(self, ctx, max_per_db=4):
+        self.ctx = ctx
+        self.max_per_db = max_per_db
+        self._port = None
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        with self._lock:
+            if self._port is None:
+                self._port = get_db_container_port(self.ctx)
+        return self._port
+
+    def dsn(self, dbname):
+        return "host=localhost dbname=%s user=odoo password=odoo port=%s" % (
             dbname,
-            db_port,
+            self.port,
         )
-        # Connect and list DBs
-        with psycopg2.connect(dsn) as db_connection:
-            with db_connection.cursor() as db_cursor:
-                db_cursor.execute(sql)
-                result = db_cursor.fetchall()
-    return result
+
+    @contextmanager
+    def connection(self, dbname):
+        with self._lock:
+            idle = self._idle[dbname]
+            connection = idle.pop() if idle else None
+        if connection is None or connection.closed:
+            connection = psycopg2.connect(self.dsn(dbname))
+            connection.autocommit = True
+        try:
+            yield connection
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            connection.close()
+            raise
+        finally:
+            self._release(dbname, connection)
+
+    def _release(self, dbname, connection):
+        if connection.closed:
+            return
+        if not connection.autocommit:
+            connection.rollback()
+            connection.autocommit = True
+        with self._lock:
+            idle = self._idle[dbname]
+            if len(idle) < self.max_per_db:
+                idle.append(connection)
+                return
+        connection.close()
+
+    @contextmanager
+    def cursor(self, dbname):
+        with self.connection(dbname) as connection:
+            with connection.cursor() as cursor:
+                yield cursor
+
+    def close_database(self, dbname):
+        """Close the idle connections to a database, to drop it"""
+        with self._lock:
+            idle = self._idle.pop(dbname, [])
+        for connection in idle:
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+_db_connections = None
+
+
+@contextmanager
+def db_session(ctx):
+    """Share the DB container and its connections within the block.
+
+    Nested blocks reuse the outer session, so a task wrapping its body
+    with it resolves the container port and connects to each database
+    only once, whatever the number of queries.
+
+    :return: the DBConnections of the session
+    """
+    global _db_connections
+    if _db_connections is not None:
+        yield _db_connections
+        return
+    with ensure_db_container_up(ctx):
+        _db_connections = DBConnections(ctx)
+        try:
+            yield _db_connections
+        finally:
+            _db_connections.close()
+            _db_connections = None
+
+
+def get_db_request_result(ctx, dbname, sql):
+    """Return the execution of given SQL request on given db"""
+    with db_session(ctx) as connections:
+        with connections.cursor(dbname) as db_cursor:
+            db_cursor.execute(sql)
+            return db_cursor.fetchall()
 
 
 def get_db_list(ctx):
@@ -102,27 +282,107 @@ def expand_path(path):
     return path
 
 
-@task(name='list-versions')
-def list_versions(ctx):
-    """Print a table of DBs with Marabunta version and install date."""
-    res = {}
+def get_db_version(connections, db_name):
+    """Return (date_done, number) of the last Marabunta version of a db"""
     sql = """
         SELECT date_done, number
         FROM marabunta_version
         ORDER BY date_done DESC
         LIMIT 1;
     """
-    # Get version for each DB
-    db_list = get_db_list(ctx)
-    for db_name in db_list:
-        try:
-            version_fetch = get_db_request_result(ctx, db_name, sql)
-            version_tuple = version_fetch[0]
-        except psycopg2.ProgrammingError:
-            # Error expected when marabunta_version table does not exist
-            version_tuple = (None, 'unknown')
-        res[db_name] = version_tuple
+    try:
+        with connections.cursor(db_name) as db_cursor:
+            db_cursor.execute(sql)
+            return db_cursor.fetchone() or (None, 'unknown')
+    except psycopg2.ProgrammingError:
+        # Error expected when marabunta_version table does not exist
+        return (None, 'unknown')
+
+
+@task(
+    name='list-versions',
+    help={
+        'jobs': 'Number of databases queried at the same time',
+        'json-output': 'Print the versions as JSON',
+        'refresh': 'Ignore the cached versions',
+    },
+)
+def list_versions(ctx, jobs=8, json_output=False, refresh=False):
+    """Print a table of DBs with Marabunta version and install date.
+
+    Versions are cached with the write counters of each database in
+    ``pg_stat_database``: a database which has not been written since
+    the last listing is not queried again.
+    """
+    # one query on 'postgres' returns the state of every database
+    sql = """
+        SELECT d.datname, d.oid,
+               s.tup_inserted + s.tup_updated + s.tup_deleted,
+               s.stats_reset
+        FROM pg_database d
+        LEFT JOIN pg_stat_database s ON s.datid = d.oid
+        WHERE d.datistemplate = false
+        AND d.datname not in ('postgres', 'odoo');
+    """
+    version_cache_path = cache_path('marabunta_versions.json')
+    cache = {}
+    if not refresh and os.path.isfile(version_cache_path):
+        with open(version_cache_path) as cache_file:
+            cache = json.load(cache_file)
+    res = {}
+    with db_session(ctx) as connections:
+        to_query = []
+        db_keys = {}
+        for db_name, oid, writes, stats_reset in get_db_request_result(
+            ctx, 'postgres', sql
+        ):
+            db_keys[db_name] = '{}:{}:{}'.format(oid, writes, stats_reset)
+            cached = cache.get(db_name)
+            if cached and cached['key'] == db_keys[db_name]:
+                date_done = cached['date_done']
+                res[db_name] = (
+                    datetime.strptime(date_done, '%Y-%m-%d %H:%M:%S')
+                    if date_done
+                    else None,
+                    cached['number'],
+                )
+            else:
+                to_query.append(db_name)
+        with ThreadPoolExecutor(max_workers=max(int(jobs), 1)) as executor:
+            versions = executor.map(
+                lambda db_name: get_db_version(connections, db_name),
+                to_query,
+            )
+            res.update(zip(to_query, versions))
+    with open(version_cache_path, 'w') as cache_file:
+        json.dump(
+            {
+                db_name: {
+                    'key': db_keys[db_name],
+                    'date_done': version[0].strftime('%Y-%m-%d %H:%M:%S')
+                    if version[0]
+                    else None,
+                    'number': version[1],
+                }
+                for db_name, version in res.items()
+            },
+            cache_file,
+        )
 
+    rows = sorted(
+        res.items(), key=lambda x: x[1][0] or datetime.min, reverse=True
+    )
+    if json_output:
+        print_json(
+            [
+                {'db_name': db_name, 'version': version[1], 'date': version[0]}
+                for db_name, version in rows
+            ]
+        )
+        return
+    if not res:
+        print('No database found')
+        return
     size1 = max([len(x) for x in res.keys()]) + 1
     size2 = max([len(x[1]) for x in res.values()]) + 1
     size3 = 10  # len('2018-01-01')
@@ -134,9 +394,7 @@ def list_versions(ctx):
         line_width += col_size
     print(thead)
     print('=' * line_width)
-    for db_name, version in sorted(
-        res.items(), key=lambda x: x[1][0] or datetime.min, reverse=True
-    ):
+    for db_name, version in rows:
         if version[0]:
             time = version[0].strftime('%Y-%m-%d')
         else:
@@ -148,43 +406,435 @@ def list_versions(ctx):
         )
 
 
-@task(name='download-dump')
-def download_dump(ctx, database_name, dumpdir='.'):
+PERF_REPORT_QUERIES = (
+    (
+        'biggest_tables',
+        'Biggest tables',
+        """
+        SELECT c.relname AS table,
+               pg_total_relation_size(c.oid) AS total_bytes,
+               pg_relation_size(c.oid) AS table_bytes,
+               pg_indexes_size(c.oid) AS index_bytes,
+               c.reltuples::bigint AS rows
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r' AND n.nspname = 'public'
+        ORDER BY pg_total_relation_size(c.oid) DESC
+        LIMIT %(limit)s
+        """,
+    ),
+    (
+        'seq_scans',
+        'Sequential scan hot spots',
+        """
+        SELECT relname AS table, seq_scan, seq_tup_read,
+               coalesce(idx_scan, 0) AS idx_scan, n_live_tup AS rows
+        FROM pg_stat_user_tables
+        WHERE seq_scan > 0
+        ORDER BY seq_tup_read DESC
+        LIMIT %(limit)s
+        """,
+    ),
+    (
+        'missing_fk_indexes',
+        'Foreign keys without index (e.g. many2one fields)',
+        """
+        SELECT c.conrelid::regclass::text AS table,
+               a.attname AS column,
+               c.confrelid::regclass::text AS referenced,
+               s.seq_scan,
+               pg_relation_size(c.conrelid) AS table_bytes
+        FROM pg_constraint c
+        JOIN pg_attribute a
+            ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.conrelid
+        WHERE c.contype = 'f'
+        AND array_length(c.conkey, 1) = 1
+        AND NOT EXISTS (
+            SELECT 1 FROM pg_index i
+            WHERE i.indrelid = c.conrelid AND i.indkey[0] = c.conkey[1]
+        )
+        ORDER BY pg_relation_size(c.conrelid) DESC
+        LIMIT %(limit)s
+        """,
+    ),
+    (
+        'unused_indexes',
+        'Unused indexes',
+        """
+        SELECT s.relname AS table, s.indexrelname AS index,
+               pg_relation_size(s.indexrelid) AS index_bytes
+        FROM pg_stat_user_indexes s
+        JOIN pg_index i ON i.indexrelid = s.indexrelid
+        WHERE s.idx_scan = 0
+        AND NOT i.indisunique AND NOT i.indisprimary
+        ORDER BY pg_relation_size(s.indexrelid) DESC
+        LIMIT %(limit)s
+        """,
+    ),
+    (
+        'table_bloat',
+        'Table bloat estimate (dead tuples)',
+        """
+        SELECT relname AS table, n_live_tup AS live, n_dead_tup AS dead,
+               round(n_dead_tup::numeric
+                     / greatest(n_live_tup + n_dead_tup, 1), 2) AS ratio,
+               (pg_relation_size(relid) * n_dead_tup
+                / greatest(n_live_tup + n_dead_tup, 1))::bigint
+                   AS wasted_bytes,
+               last_autovacuum
+        FROM pg_stat_user_tables
+        WHERE n_dead_tup > 0
+        ORDER BY 5 DESC
+        LIMIT %(limit)s
+        """,
+    ),
+    (
+        'index_bloat',
+        'Index bloat estimate',
+        # expected size: rows * (key width + tuple header) / fillfactor
+        """
+        SELECT t.relname AS table, ic.relname AS index,
+               pg_relation_size(ic.oid) AS index_bytes,
+               greatest(pg_relation_size(ic.oid) - (
+                   t.reltuples * (coalesce(w.width, 8) + 16) / 0.9
+               ), 0)::bigint AS wasted_bytes
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        LEFT JOIN LATERAL (
+            SELECT sum(st.avg_width) AS width
+            FROM pg_attribute a
+            JOIN pg_stats st
+                ON st.schemaname = n.nspname
+                AND st.tablename = t.relname
+                AND st.attname = a.attname
+            WHERE a.attrelid = t.oid AND a.attnum = ANY(i.indkey)
+        ) w ON true
+        WHERE n.nspname = 'public' AND ic.relam = (
+            SELECT oid FROM pg_am WHERE amname = 'btree'
+        )
+        ORDER BY 4 DESC
+        LIMIT %(limit)s
+        """,
+    ),
+    (
+        'cache_hit_ratio',
+        'Cache hit ratio',
+        """
+        SELECT 'database' AS scope,
+               round(blks_hit::numeric
+                     / greatest(blks_hit + blks_read, 1), 4) AS ratio
+        FROM pg_stat_database WHERE datname = current_database()
+        UNION ALL
+        SELECT 'tables',
+               round(sum(heap_blks_hit)::numeric
+                     / greatest(sum(heap_blks_hit + heap_blks_read), 1), 4)
+        FROM pg_statio_user_tables
+        UNION ALL
+        SELECT 'indexes',
+               round(sum(idx_blks_hit)::numeric
+                     / greatest(sum(idx_blks_hit + idx_blks_read), 1), 4)
+        FROM pg_statio_user_indexes
+        """,
+    ),
+)
+
+
+def _fetch_dicts(db_cursor, sql, params=None):
+    db_cursor.execute(sql, params)
+    columns = [column[0] for column in db_cursor.description]
+    return [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+
+
+def _top_queries(db_cursor, limit):
+    """Return the top queries of pg_stat_statements, None if unavailable"""
+    db_cursor.execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'"
+    )
+    if not db_cursor.fetchone():
+        try:
+            db_cursor.execute('CREATE EXTENSION pg_stat_statements')
+        except psycopg2.Error:
+            # not in shared_preload_libraries
+            return None
+    # the columns were renamed in PostgreSQL 13
+    db_cursor.execute(
+        "SELECT 1 FROM pg_attribute "
+        "WHERE attrelid = 'pg_stat_statements'::regclass "
+        "AND attname = 'total_exec_time'"
+    )
+    prefix = 'exec_' if db_cursor.fetchone() else ''
+    try:
+        return _fetch_dicts(
+            db_cursor,
+            """
+            SELECT round(total_{0}time::numeric, 1) AS total_ms,
+                   calls,
+                   round(mean_{0}time::numeric, 2) AS mean_ms,
+                   rows,
+                   left(regexp_replace(query, '\\s+', ' ', 'g'), 120)
+                       AS query
+            FROM pg_stat_statements
+            WHERE dbid = (
+                SELECT oid FROM pg_database WHERE datname = current_database()
+            )
+            ORDER BY total_{0}time DESC
+            LIMIT %(limit)s
+            """.format(
+                prefix
+            ),
+            {'limit': limit},
+        )
+    except psycopg2.Error:
+        return None
+
+
+def _print_report_section(title, rows):
+    print('')
+    print(title)
+    print('=' * len(title))
+    if not rows:
+        print('Nothing to report')
+        return
+    columns = list(rows[0])
+    values = [
+        [
+            human_size(row[col]) if col.endswith('_bytes') else str(row[col])
+            for col in columns
+        ]
+        for row in rows
+    ]
+    widths = [
+        max([len(col)] + [len(value[index]) for value in values])
+        for index, col in enumerate(columns)
+    ]
+    line = '  '.join('{:<%s}' % width for width in widths)
+    print(line.format(*columns))
+    for value in values:
+        print(line.format(*value))
+
+
+@task(
+    name='perf-report',
+    help={
+        'limit': 'Number of rows per section',
+        'json-output': 'Print the report as JSON',
+    },
+)
+def perf_report(ctx, db_name, limit=15, json_output=False):
+    """Print a performance health report of a database.
+
+    Top queries (pg_stat_statements), bloat estimates, unused indexes,
+    foreign keys without index, sequential scan hot spots, cache hit
+    ratios and biggest tables. Statistics are cumulative since their
+    last reset, so the report is meaningful on a database that has been
+    used for a while.
+    """
+    report = {}
+    with db_session(ctx) as connections:
+        with connections.cursor(db_name) as db_cursor:
+            report['top_queries'] = _top_queries(db_cursor, int(limit))
+            for key, __, sql in PERF_REPORT_QUERIES:
+                report[key] = _fetch_dicts(
+                    db_cursor, sql, {'limit': int(limit)}
+                )
+    if json_output:
+        print_json(report)
+        return
+    if report['top_queries'] is None:
+        print(
+            'pg_stat_statements is not available, add it to '
+            'shared_preload_libraries of the db service'
+        )
+    else:
+        _print_report_section('Top queries', report['top_queries'])
+    for key, title, __ in PERF_REPORT_QUERIES:
+        _print_report_section(title, report[key])
+
+
+def _dump_date(key, last_modified):
+    """Date of a dump from its name ({name}-YYYYmmdd-HHMMSS), or its upload"""
+    match = DUMP_DATE_RE.search(os.path.basename(key))
+    if match:
+        try:
+            return datetime.strptime(''.join(match.groups()), '%Y%m%d%H%M%S')
+        except ValueError:
+            pass  # digits which are not a date
+    return last_modified.replace(tzinfo=None)
+
+
+def get_dump_catalogue(database_name, endpoint_url=None, refresh=False):
+    """Return the dumps of a database on the dump bag, the oldest first.
+
+    The listing is paginated (more than 1000 dumps) and cached locally
+    for DUMP_LIST_TTL seconds, per database and S3 server.
+
+    :param database_name: S3 folder of the dumps, like fighting_snail_1024
+    :param endpoint_url: S3 compatible server to use instead of AWS
+    :param refresh: ignore the cached listing
+    :return: a list of {key, name, date, size} dicts
+    """
+    endpoint_url = endpoint_url or os.environ.get('ODOO_DUMPS_ENDPOINT_URL')
+    server = hashlib.sha1((endpoint_url or 'aws').encode('utf-8'))
+    catalogue_path = cache_path(
+        'dumps', '{}-{}.json'.format(database_name, server.hexdigest()[:8])
+    )
+    if not refresh and os.path.isfile(catalogue_path):
+        with open(catalogue_path) as catalogue_file:
+            cached = json.load(catalogue_file)
+        if time.time() - cached['date'] < DUMP_LIST_TTL:
+            return cached['dumps']
+    paginator = s3_client(endpoint_url).get_paginator('list_objects_v2')
+    dumps = [
+        {
+            'key': obj['Key'],
+            'name': os.path.basename(obj['Key']),
+            'date': _dump_date(obj['Key'], obj['LastModified']).strftime(
+                '%Y-%m-%d %H:%M:%S'
+            ),
+            'size': obj['Size'],
+        }
+        for page in paginator.paginate(
+            Bucket=DUMP_BAG_BUCKET, Prefix=database_name + '/'
+        )
+        for obj in page.get('Contents', [])
+    ]
+    dumps.sort(key=lambda dump: (dump['date'], dump['name']))
+    with open(catalogue_path, 'w') as catalogue_file:
+        json.dump({'date': time.time(), 'dumps': dumps}, catalogue_file)
+    return dumps
+
+
+def _parse_dump_day(dump):
+    """Return the YYYY-mm-dd date given as ``dump``, None if not a date"""
+    try:
+        return datetime.strptime(dump, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _match_dump(dumps, dump=None):
+    """Return the dump named ``dump``, or the latest one of this day.
+
+    :param dump: name of the dump (with or without .gpg), or a date as
+        YYYY-mm-dd, the latest dump when empty
+    """
+    if not dump:
+        return dumps[-1] if dumps else None
+    for candidate in dumps:
+        if dump in (candidate['name'], os.path.splitext(candidate['name'])[0]):
+            return candidate
+    day = _parse_dump_day(dump)
+    dumps = [candidate for candidate in dumps if candidate['date'][:10] == day]
+    return dumps[-1] if dumps else None
+
+
+def select_dump(database_name, dump=None, endpoint_url=None, refresh=False):
+    """Return the dump to download from the catalogue, exit if not found.
+
+    A dump missing from the cached listing is looked for again on S3.
+    """
+    found = _match_dump(
+        get_dump_catalogue(database_name, endpoint_url, refresh=refresh), dump
+    )
+    if not found and not refresh:
+        found = _match_dump(
+            get_dump_catalogue(database_name, endpoint_url, refresh=True), dump
+        )
+    if found:
+        return found
+    if not dump:
+        exit_msg('No dump found for {}'.format(database_name))
+    if _parse_dump_day(dump):
+        exit_msg('No dump of {} found for {}'.format(dump, database_name))
+    exit_msg(
+        'No dump named {} found for {}, and it is not a date '
+        '(YYYY-mm-dd)'.format(dump, database_name)
+    )
+
+
+@task(
+    name='list-dumps',
+    help={
+        'refresh': 'List the dumps again instead of using the cached list',
+        'endpoint-url': 'S3 compatible server to use instead of AWS',
+    },
+)
+def list_dumps(
+    ctx, database_name, endpoint_url=None, refresh=False, json_output=False
+):
+    """List the dumps of a database on the dump bag, the latest last."""
+    dumps = get_dump_catalogue(database_name, endpoint_url, refresh=refresh)
+    if json_output:
+        print_json(dumps)
+        return
+    for dump in dumps:
+        print(
+            '{} {:>10} {}'.format(
+                dump['date'], human_size(dump['size']), dump['name']
+            )
+        )
+
+
+@task(
+    name='download-dump',
+    help={
+        'jobs': 'Number of parts downloaded at the same time',
+        'endpoint-url': 'S3 compatible server to use instead of AWS',
+        'dump': 'Name or date (YYYY-mm-dd) of the dump, the latest one '
+        'by default',
+        'refresh': 'List the dumps again instead of using the cached list',
+    },
+)
+def download_dump(
+    ctx,
+    database_name,
+    dumpdir='.',
+    jobs=DOWNLOAD_CONCURRENCY,
+    endpoint_url=None,
+    dump=None,
+    refresh=False,
+):
     """Download Dump
 
-    Works only with Aws
+    Works with Aws or an S3 compatible server
+
+    The dump is downloaded by parts in parallel, an interrupted download
+    is resumed and the dump is checked against its ETag.
 
     :param database_name: Aws database folder name like -> fighting_snail_1024
     :param dumpdir: Location of Dump directory
+    :param jobs: Number of parts downloaded at the same time
+    :param endpoint_url: S3 compatible server to use instead of AWS
+    :param dump: Name or date of the dump, the latest one by default
+    :param refresh: Do not use the cached list of dumps
     :return: Decrypted Dump on the dumpdir
     """
     # TODO May be change the input (now it's database_name) given in hard but
     # after may be doing dict in Lastpass with {project_name: database_name}
     # or a other solution
-    # TODO  to be able to select a dump which is not the latest one,
-    # although the latest should obviously be default.
 
-    # Get name of dump in aws list of dump
-    try:
-        dump_path = _get_list_of_dumps(ctx, database_name)[-1]  # get the last
-    except IndexError:
-        exit_msg('Dump not found for {}'.format(database_name))
+    dump_key = select_dump(
+        database_name, dump, endpoint_url=endpoint_url, refresh=refresh
+    )['key']
     # gpg_fname is like fighting_snail_1024[...].pg.gpg
-    gpg_fname = os.path.basename(dump_path)
+    gpg_fname = os.path.basename(dump_key)
     # fname is like fighting_snail_1024[...].pg
     fname = os.path.splitext(gpg_fname)[0]
 
     make_dir(dumpdir)
     with cd(dumpdir):
-        s3_path_dump = os.path.join(
-            base_s3_dump_path, database_name, gpg_fname
-        )
+        s3_path_dump = os.path.join(base_s3_dump_path, dump_key)
         downloaded = False
         if not os.path.isfile(gpg_fname):
             print('S3 Downloading dump...')
             print('From:', s3_path_dump)
             print('to:', os.getcwd())
-            _download_from_dumpbag(ctx, s3_path_dump)
+            _download_from_dumpbag(
+                ctx, s3_path_dump, jobs=jobs, endpoint_url=endpoint_url
+            )
             downloaded = True
         else:
             print(
@@ -205,33 +855,706 @@ def download_dump(ctx, database_name, dumpdir='.'):
             )
 
 
-@task(name='local-dump')
-def local_dump(ctx, db_name='odoodb', path='.'):
+def _pg_env():
+    """Environment for the PostgreSQL client tools run on the container"""
+    env = os.environ.copy()
+    env.setdefault('PGPASSWORD', 'odoo')
+    return env
+
+
+def _new_dump_name(extension='pg'):
+    """Name of a new dump as {user}_{project}-{timestamp}.{extension}"""
+    return '{}_{}-{}.{}'.format(
+        getpass.getuser(),
+        cookiecutter_context()['project_name'],
+        datetime.now().strftime('%Y%m%d-%H%M%S'),
+        extension,
+    )
+
+
+def _path_size(path):
+    """Size of a file, or of the files of a directory"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    return sum(
+        entry.stat().st_size for entry in os.scandir(path) if entry.is_file()
+    )
+
+
+def _create_database(connections, db_name):
+    """Create an empty database owned by odoo, abort if it exists"""
+    with connections.cursor('postgres') as db_cursor:
+        db_cursor.execute(
+            "SELECT 1 FROM pg_database WHERE datname = %s", (db_name,)
+        )
+        if db_cursor.fetchone():
+            exit_msg('Database {} already exists'.format(db_name))
+        db_cursor.execute(
+            SQL('CREATE DATABASE {} OWNER odoo').format(Identifier(db_name))
+        )
+
+
+def _drop_database(connections, db_name):
+    """Drop a database if it exists"""
+    connections.close_database(db_name)
+    with connections.cursor('postgres') as db_cursor:
+        db_cursor.execute(
+            SQL('DROP DATABASE IF EXISTS {}').format(Identifier(db_name))
+        )
+
+
+def _restore_stream(key, response, decrypt_cmd, restore_cmd, dump_path):
+    """Decrypt a dump into pg_restore, or into ``dump_path`` if given
+
+    A download error is raised once gpg and pg_restore are stopped.
+
+    :return: the error of the pipeline, None on success
+    """
+    progress = TransferProgress(
+        'Downloading {}'.format(key), total=response['ContentLength']
+    )
+    restore = None
+    if dump_path:
+        output = open(dump_path, 'wb')
+    else:
+        restore = subprocess.Popen(
+            restore_cmd, stdin=subprocess.PIPE, env=_pg_env()
+        )
+        output = restore.stdin
+    # gpg writes straight into pg_restore (or the file), only the
+    # downloaded data goes through python
+    decrypt = subprocess.Popen(
+        decrypt_cmd, stdin=subprocess.PIPE, stdout=output
+    )
+    output.close()
+    try:
+        _copy_stream(response['Body'], decrypt.stdin, progress=progress)
+    except BrokenPipeError:
+        # gpg exited early, its exit code or pg_restore's tells why
+        pass
+    except BaseException:
+        # a download error or an interruption: stop the pipeline, so
+        # pg_restore does not hold a connection to the database anymore
+        for process in (decrypt, restore):
+            if process:
+                process.kill()
+        raise
+    finally:
+        try:
+            decrypt.stdin.close()
+        except BrokenPipeError:
+            pass
+        decrypt.wait()
+        if restore:
+            restore.wait()
+    progress.finish()
+    # gpg fails when pg_restore stops reading, report the first cause
+    if restore and restore.returncode:
+        return 'pg_restore failed with code {}'.format(restore.returncode)
+    if decrypt.returncode:
+        return 'gpg failed with code {}'.format(decrypt.returncode)
+
+
+@task(
+    name='fetch-and-restore',
+    help={
+        'jobs': 'With more than 1 job, the decrypted dump is written in '
+        'tmp-path to be restored with pg_restore -j',
+        'dump': 'Name or date (YYYY-mm-dd) of the dump, the latest one '
+        'by default',
+        'refresh': 'List the dumps again instead of using the cached list',
+    },
+)
+def fetch_and_restore(
+    ctx,
+    database_name,
+    db_name,
+    jobs=1,
+    tmp_path='/tmp',
+    endpoint_url=None,
+    dump=None,
+    refresh=False,
+):
+    """Download, decrypt and restore a dump in one pipeline.
+
+    The object is streamed from the dump bag through gpg into pg_restore,
+    without any intermediate file. pg_restore cannot restore in parallel
+    from a stream: with ``--jobs``, the decrypted dump is written once in
+    ``tmp_path`` (and removed afterwards) to be restored in parallel.
+
+    :param database_name: Aws database folder name like -> fighting_snail_1024
+    :param db_name: Name of the new database to restore into
+    :param jobs: Number of pg_restore jobs
+    :param tmp_path: Where to write the dump for a parallel restore
+    :param endpoint_url: S3 compatible server to use instead of AWS
+    :param dump: Name or date of the dump, the latest one by default
+    :param refresh: Do not use the cached list of dumps
+    """
+    jobs = int(jobs)
+    key = select_dump(
+        database_name, dump, endpoint_url=endpoint_url, refresh=refresh
+    )['key']
+    bucket = DUMP_BAG_BUCKET
+    client = s3_client(endpoint_url)
+    password_gpg = get_from_lastpass(ctx, LPASS_GPG_DUMP_KEY_ID, "-p")
+    with db_session(ctx) as connections:
+        _create_database(connections, db_name)
+        restore_cmd = [
+            'pg_restore',
+            '-h',
+            'localhost',
+            '-p',
+            str(connections.port),
+            '-U',
+            'odoo',
+            '--no-owner',
+            '--no-acl',
+            '-d',
+            db_name,
+        ]
+        decrypt_cmd = [
+            'gpg',
+            '--yes',
+            '--passphrase',
+            password_gpg,
+            '--no-tty',
+            '--quiet',
+            '--decrypt',
+        ]
+        response = client.get_object(Bucket=bucket, Key=key)
+        dump_file_path = None
+        if jobs > 1:
+            dump_file_path = os.path.join(
+                expand_path(tmp_path),
+                os.path.splitext(os.path.basename(key))[0],
+            )
+        # a failed restore leaves no half restored database behind
+        try:
+            error = _restore_stream(
+                key, response, decrypt_cmd, restore_cmd, dump_file_path
+            )
+            if dump_file_path and not error:
+                start = time.time()
+                try:
+                    subprocess.check_call(
+                        restore_cmd + ['--jobs', str(jobs), dump_file_path],
+                        env=_pg_env(),
+                    )
+                except subprocess.CalledProcessError as e:
+                    error = 'pg_restore failed with code {}'.format(
+                        e.returncode
+                    )
+                else:
+                    print('Restored in {:.1f}s'.format(time.time() - start))
+        except BaseException:
+            _drop_database(connections, db_name)
+            raise
+        finally:
+            if dump_file_path and os.path.exists(dump_file_path):
+                os.remove(dump_file_path)
+        if error:
+            _drop_database(connections, db_name)
+            exit_msg('{}, database {} dropped'.format(error, db_name))
+    print('Dump {} restored in database {}'.format(key, db_name))
+
+
+@task(
+    name='local-dump',
+    help={
+        'jobs': 'With more than 1 job, dump in directory format with '
+        'pg_dump -j',
+        'compress': 'pg_dump compression, a level (0-9) or for '
+        'pg_dump >= 16 a method as gzip:6, lz4 or zstd:3',
+    },
+)
+def local_dump(ctx, db_name='odoodb', path='.', jobs=1, compress=None):
     """Create a PG Dump for given database name.
 
+    With ``--jobs`` above 1, tables are dumped in parallel and the dump is
+    a directory (``*.pgdir``) to restore with ``pg_restore -j``.
+
     :param db_name: Name of the Database to dump
     :param path: Local path to store the dump
+    :param jobs: Number of tables dumped in parallel
+    :param compress: Compression level or method given to pg_dump
     :return: Dump file path
     """
     path = expand_path(path)
-    with ensure_db_container_up(ctx):
-        db_port = get_db_container_port(ctx)
-        username = getpass.getuser()
-        project_name = cookiecutter_context()['project_name']
-        dump_name = '{}_{}-{}.pg'.format(
-            username, project_name, datetime.now().strftime('%Y%m%d-%H%M%S')
-        )
+    jobs = int(jobs)
+    with db_session(ctx) as connections:
+        db_port = connections.port
+        dump_name = _new_dump_name('pgdir' if jobs > 1 else 'pg')
         dump_file_path = '{}/{}'.format(path, dump_name)
-        ctx.run(
-            'pg_dump -h localhost -p {} --format=c -U odoo --file {} {}'.format(
-                db_port, dump_file_path, db_name
-            ),
-            hide=True,
-        )
+        cmd = [
+            'pg_dump',
+            '-h',
+            'localhost',
+            '-p',
+            str(db_port),
+            '-U',
+            'odoo',
+            '--file',
+            dump_file_path,
+        ]
+        if jobs > 1:
+            cmd += ['--format=d', '--jobs', str(jobs)]
+        else:
+            cmd += ['--format=c']
+        if compress is not None:
+            cmd += ['--compress', str(compress)]
+        cmd.append(db_name)
+        progress = TransferProgress('Dumping {}'.format(db_name))
+        process = subprocess.Popen(cmd, env=_pg_env())
+        while process.poll() is None:
+            progress.update(_path_size(dump_file_path))
+            time.sleep(0.5)
+        if process.returncode:
+            exit_msg('pg_dump failed with code {}'.format(process.returncode))
+        progress.update(_path_size(dump_file_path))
+        progress.finish()
         print('Dump succesfully generated at %s' % dump_file_path)
     return dump_file_path
 
 
+SUBSET_CHUNK_SIZE = 10000
+
+SUBSET_TABLES_SQL = """
+    SELECT c.relname,
+           -- about 100 bytes per row for the tables never analyzed
+           CASE
+               WHEN c.reltuples >= 0 THEN c.reltuples
+               ELSE pg_relation_size(c.oid) / 100
+           END::bigint,
+           EXISTS (
+               SELECT 1 FROM pg_attribute a
+               WHERE a.attrelid = c.oid AND a.attname = 'id'
+               AND NOT a.attisdropped
+           )
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+"""
+
+# single column foreign keys to the id of a table, as Odoo creates them
+SUBSET_FKEYS_SQL = """
+    SELECT child.relname, a.attname, parent.relname, c.confdeltype = 'c'
+    FROM pg_constraint c
+    JOIN pg_class child ON child.oid = c.conrelid
+    JOIN pg_class parent ON parent.oid = c.confrelid
+    JOIN pg_namespace n ON n.oid = c.connamespace
+    JOIN pg_attribute a
+        ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+    JOIN pg_attribute pa
+        ON pa.attrelid = c.confrelid AND pa.attnum = c.confkey[1]
+    WHERE c.contype = 'f' AND n.nspname = 'public'
+    AND array_length(c.conkey, 1) = 1 AND pa.attname = 'id'
+"""
+
+
+def _chunks(values, size=SUBSET_CHUNK_SIZE):
+    values = sorted(values)
+    for index in range(0, len(values), size):
+        yield values[index : index + size]
+
+
+def _subset_closure(db_cursor, seeds, references, owned, full_tables):
+    """Return {table: ids} closed over the foreign keys of the seeds.
+
+    The rows referenced by a selected row are selected (``references`` is
+    {table: [(column, parent table)]}), and so are the rows owned by it
+    through an ON DELETE CASCADE key (``owned`` is {table: [(child table,
+    column)]}), except for the tables copied in full.
+    """
+    selected = defaultdict(set)
+    pending = defaultdict(set)
+    for table, ids in seeds.items():
+        pending[table] |= set(ids)
+    while pending:
+        table, ids = pending.popitem()
+        ids -= selected[table]
+        if not ids:
+            continue
+        selected[table] |= ids
+        for chunk in _chunks(ids):
+            for column, parent in references.get(table, ()):
+                db_cursor.execute(
+                    SQL(
+                        'SELECT DISTINCT {col} FROM {table} '
+                        'WHERE id = ANY(%s) AND {col} IS NOT NULL'
+                    ).format(col=Identifier(column), table=Identifier(table)),
+                    (chunk,),
+                )
+                new_ids = {row[0] for row in db_cursor} - selected[parent]
+                pending[parent] |= new_ids
+            if table in full_tables:
+                continue
+            for child, column in owned.get(table, ()):
+                db_cursor.execute(
+                    SQL('SELECT id FROM {table} WHERE {col} = ANY(%s)').format(
+                        col=Identifier(column), table=Identifier(child)
+                    ),
+                    (chunk,),
+                )
+                pending[child] |= {row[0] for row in db_cursor}
+    return selected
+
+
+def _copy_rows(source_cursor, target_cursor, table, query, params=None):
+    """Copy the rows of a query on the source into a table of the target"""
+    buf = io.BytesIO()
+    copy_sql = SQL('COPY ({}) TO STDOUT').format(query)
+    source_cursor.copy_expert(
+        source_cursor.mogrify(copy_sql, params).decode('utf-8'), buf
+    )
+    buf.seek(0)
+    target_cursor.copy_expert(
+        SQL('COPY {} FROM STDIN')
+        .format(Identifier(table))
+        .as_string(target_cursor),
+        buf,
+    )
+
+
+def _copy_relation_rows(source_cursor, target_cursor, table, fkeys, selected):
+    """Copy the rows of a table without id whose references are selected"""
+    first_column, first_parent = fkeys[0]
+    query = SQL('SELECT * FROM {} WHERE {} = ANY(%s)').format(
+        Identifier(table), Identifier(first_column)
+    )
+    for chunk in _chunks(selected.get(first_parent, ())):
+        source_cursor.execute(query, (chunk,))
+        columns = [column.name for column in source_cursor.description]
+        refs = [
+            (columns.index(column), selected.get(parent, ()))
+            for column, parent in fkeys
+        ]
+        rows = [
+            row
+            for row in source_cursor.fetchall()
+            if all(row[pos] is None or row[pos] in ids for pos, ids in refs)
+        ]
+        if rows:
+            insert = SQL('INSERT INTO {} ({}) VALUES %s').format(
+                Identifier(table), SQL(', ').join(map(Identifier, columns))
+            )
+            execute_values(
+                target_cursor, insert.as_string(target_cursor), rows
+            )
+
+
+def _restore_section(connections, source_db, db_name, section):
+    """Copy a section of the schema of a database with pg_dump|pg_restore"""
+    options = ['-h', 'localhost', '-p', str(connections.port), '-U', 'odoo']
+    dump = subprocess.Popen(
+        ['pg_dump', '--format=c', '--section', section, source_db] + options,
+        stdout=subprocess.PIPE,
+        env=_pg_env(),
+    )
+    restore = subprocess.Popen(
+        ['pg_restore', '--no-owner', '--no-acl', '-d', db_name] + options,
+        stdin=dump.stdout,
+        env=_pg_env(),
+    )
+    dump.stdout.close()
+    restore.wait()
+    dump.wait()
+    if dump.returncode or restore.returncode:
+        exit_msg('Restoring the {} of {} failed'.format(section, source_db))
+
+
+def _subset_select(
+    source_cursor, source_db, seed_table, where, percent, full_threshold
+):
+    """Select the rows of a subset, exit if the seed rows are invalid.
+
+    :return: (tables, references, full tables, {table: selected ids})
+    """
+    source_cursor.execute(SUBSET_TABLES_SQL)
+    tables = {
+        name: {'rows': rows, 'has_id': has_id}
+        for name, rows, has_id in source_cursor.fetchall()
+    }
+    if not tables.get(seed_table, {}).get('has_id'):
+        exit_msg('No table {} with an id in {}'.format(seed_table, source_db))
+    references = defaultdict(list)
+    owned = defaultdict(list)
+    source_cursor.execute(SUBSET_FKEYS_SQL)
+    for child, column, parent, cascade in source_cursor.fetchall():
+        references[child].append((column, parent))
+        if cascade and tables[child]['has_id']:
+            owned[parent].append((child, column))
+    full_tables = {
+        name
+        for name, table in tables.items()
+        if table['rows'] < full_threshold
+    }
+
+    seeds = defaultdict(set)
+    query = SQL('SELECT id FROM {}').format(Identifier(seed_table))
+    if percent:
+        query += SQL(' TABLESAMPLE SYSTEM ({})').format(
+            Literal(float(percent))
+        )
+    if where:
+        query += SQL(' WHERE ') + SQL(where)
+    source_cursor.execute('SAVEPOINT seed_rows')
+    try:
+        source_cursor.execute(query)
+    except (psycopg2.ProgrammingError, psycopg2.DataError) as e:
+        source_cursor.execute('ROLLBACK TO SAVEPOINT seed_rows')
+        exit_msg('Invalid seed rows condition: {}'.format(e))
+    seeds[seed_table] = {row[0] for row in source_cursor}
+    print('{} seed rows in {}'.format(len(seeds[seed_table]), seed_table))
+    for name in full_tables:
+        if tables[name]['has_id']:
+            source_cursor.execute(
+                SQL('SELECT id FROM {}').format(Identifier(name))
+            )
+            seeds[name] |= {row[0] for row in source_cursor}
+            continue
+        for column, parent in references.get(name, ()):
+            source_cursor.execute(
+                SQL(
+                    'SELECT DISTINCT {col} FROM {table} '
+                    'WHERE {col} IS NOT NULL'
+                ).format(col=Identifier(column), table=Identifier(name))
+            )
+            seeds[parent] |= {row[0] for row in source_cursor}
+    selected = _subset_closure(
+        source_cursor, seeds, references, owned, full_tables
+    )
+    return tables, references, full_tables, selected
+
+
+def _subset_copy(
+    source_cursor, target_cursor, tables, references, full_tables, selected
+):
+    """Copy the selected rows and the sequences into the subset database"""
+    for name in sorted(tables):
+        table_query = SQL('SELECT * FROM {}').format(Identifier(name))
+        if name in full_tables:
+            _copy_rows(source_cursor, target_cursor, name, table_query)
+        elif tables[name]['has_id']:
+            for chunk in _chunks(selected.get(name, ())):
+                _copy_rows(
+                    source_cursor,
+                    target_cursor,
+                    name,
+                    table_query + SQL(' WHERE id = ANY(%s)'),
+                    (chunk,),
+                )
+        elif references.get(name):
+            _copy_relation_rows(
+                source_cursor, target_cursor, name, references[name], selected
+            )
+    source_cursor.execute(
+        """
+        SELECT sequencename, last_value FROM pg_sequences
+        WHERE schemaname = 'public' AND last_value IS NOT NULL
+        """
+    )
+    for sequence, last_value in source_cursor.fetchall():
+        target_cursor.execute(
+            'SELECT setval(quote_ident(%s)::regclass, %s)',
+            (sequence, last_value),
+        )
+
+
+@task(
+    name='subset',
+    help={
+        'seed-table': 'Table of the rows the subset is built from',
+        'where': 'SQL condition on the seed table (e.g. training_id = 3)',
+        'percent': 'Percentage of the seed table rows taken at random',
+        'db-name': 'Name of the subset database (default: '
+        '<source-db>_subset)',
+        'full-threshold': 'Tables with fewer rows are copied in full',
+        'dump': 'Dump the subset database with local-dump',
+    },
+)
+def subset(
+    ctx,
+    source_db,
+    seed_table,
+    where=None,
+    percent=None,
+    db_name=None,
+    full_threshold=10000,
+    path='.',
+    jobs=1,
+    dump=True,
+):
+    """Create a consistent subset of a database and dump it.
+
+    The seed rows (e.g. ``--seed-table res_partner --percent 2`` or
+    ``--seed-table students_student --where "training_id = 3"``) are
+    completed by the rows they reference through foreign keys, and the
+    rows they own through ON DELETE CASCADE keys, recursively. Tables
+    smaller than ``full_threshold`` rows (companies, users, configuration)
+    are copied in full; relation tables keep the rows whose both sides are
+    in the subset.
+
+    The schema is copied first, the selected rows with COPY, then the
+    indexes and constraints, which validates the subset. References
+    without foreign keys (res_model/res_id) are not followed and the
+    filestore is not copied.
+    """
+    db_name = db_name or '{}_subset'.format(source_db)
+    full_threshold = int(full_threshold)
+    with db_session(ctx) as connections:
+        start = time.time()
+        with connections.cursor(source_db) as source_cursor:
+            # one snapshot of the source for the selection and the copy
+            source_cursor.execute(
+                'BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY'
+            )
+            try:
+                # the seed table and condition are checked before the
+                # subset database is created
+                tables, references, full_tables, selected = _subset_select(
+                    source_cursor,
+                    source_db,
+                    seed_table,
+                    where,
+                    percent,
+                    full_threshold,
+                )
+                print(
+                    '{} rows selected in {:.1f}s'.format(
+                        sum(len(ids) for ids in selected.values()),
+                        time.time() - start,
+                    )
+                )
+                _create_database(connections, db_name)
+                # a failed subset leaves no half built database behind
+                try:
+                    _restore_section(
+                        connections, source_db, db_name, 'pre-data'
+                    )
+                    with connections.cursor(db_name) as target_cursor:
+                        _subset_copy(
+                            source_cursor,
+                            target_cursor,
+                            tables,
+                            references,
+                            full_tables,
+                            selected,
+                        )
+                    _restore_section(
+                        connections, source_db, db_name, 'post-data'
+                    )
+                except BaseException:
+                    _drop_database(connections, db_name)
+                    raise
+            finally:
+                # the pool does not end a transaction opened with BEGIN
+                if not source_cursor.connection.closed:
+                    source_cursor.execute('ROLLBACK')
+        print(
+            'Subset of {} created as {} in {:.1f}s'.format(
+                source_db, db_name, time.time() - start
+            )
+        )
+        if dump:
+            return local_dump(ctx, db_name=db_name, path=path, jobs=jobs)
+
+
+def get_dump_bag_fingerprints(gpg):
+    """Return the fingerprints of the dump-bag keys.
+
+    The keys are cached locally and only imported in the keyring when
+    they changed or are missing from it.
+    """
+    keys_path = cache_path('dump_bag_keys.json')
+    cached = {}
+    if os.path.isfile(keys_path):
+        with open(keys_path) as keys_file:
+            cached = json.load(keys_file)
+    known = {str(rec['fingerprint']) for rec in gpg.list_keys()}
+    if (
+        cached
+        and time.time() - cached['date'] < DUMP_BAG_KEYS_TTL
+        and set(cached['fingerprints']) <= known
+    ):
+        return cached['fingerprints']
+    r = requests.get(DUMP_BAG_KEYS_URL)
+    r.raise_for_status()
+    if cached.get('keys') == r.text and set(cached['fingerprints']) <= known:
+        fingerprints = cached['fingerprints']
+    else:
+        result = gpg.import_keys(r.text)
+        fingerprints = sorted({str(fpr) for fpr in result.fingerprints})
+    cached = {
+        'date': time.time(),
+        'keys': r.text,
+        'fingerprints': fingerprints,
+    }
+    with open(keys_path, 'w') as keys_file:
+        json.dump(cached, keys_file)
+    return fingerprints
+
+
+def _copy_stream(instream, outstream, progress=None):
+    """Copy a stream to another one by blocks of STREAM_BLOCK_SIZE"""
+    while True:
+        block = instream.read(STREAM_BLOCK_SIZE)
+        if not block:
+            break
+        outstream.write(block)
+        if progress:
+            progress.add(len(block))
+
+
+def gpg_encrypt_stream(gpg, fingerprints, instream, outstream, progress=None):
+    """Encrypt a stream for the given keys into another stream.
+
+    Data goes through the gpg process by blocks, so the memory used does
+    not depend on the size of the data.
+
+    :param gpg: gnupg.GPG instance holding the keys
+    :param fingerprints: fingerprints of the recipients
+    :param instream: binary file-like object to read from
+    :param outstream: binary file-like object to write the encrypted data
+    :param progress: optional TransferProgress updated with the data read
+    """
+    cmd = [getattr(gpg, 'binary', None) or 'gpg']
+    if getattr(gpg, 'homedir', None):
+        cmd += ['--homedir', gpg.homedir]
+    cmd += ['--batch', '--yes', '--trust-model', 'always', '--encrypt']
+    for fingerprint in fingerprints:
+        cmd += ['--recipient', fingerprint]
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    errors = []
+
+    def feed():
+        try:
+            _copy_stream(instream, process.stdin, progress=progress)
+        except Exception as e:  # reported in the main thread
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass  # gpg was killed, the error is raised by the main thread
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    try:
+        _copy_stream(process.stdout, outstream)
+    except Exception:
+        process.kill()
+        raise
+    finally:
+        feeder.join()
+        process.wait()
+    if errors:
+        raise errors[0]
+    if process.returncode:
+        exit_msg('gpg failed with code {}'.format(process.returncode))
+
+
 def encrypt_for_dump_bags(ctx, dump_file_path):
     """Encrypt dump to GPG using keys from dump-bag.odoo.camptocamp.ch
 
@@ -239,18 +1562,185 @@ def encrypt_for_dump_bags(ctx, dump_file_path):
     :return: Path of the encrypted GPG dump
     """
     gpg_file_path = '%s.gpg' % dump_file_path
-    r = requests.get('https://dump-bag.odoo.camptocamp.ch/keys')
     gpg = gnupg.GPG()
-    gpg.import_keys(r.text)
-    fingerprints = [str(rec['fingerprint']) for rec in gpg.list_keys()]
+    fingerprints = get_dump_bag_fingerprints(gpg)
+    progress = TransferProgress(
+        'Encrypting', total=os.path.getsize(dump_file_path)
+    )
     with open(dump_file_path, 'rb') as dump_file:
-        data = gpg.encrypt(dump_file, *fingerprints)
-    with open(gpg_file_path, 'wb') as encrypted_dump:
-        encrypted_dump.write(data.data)
+        with open(gpg_file_path, 'wb') as encrypted_dump:
+            gpg_encrypt_stream(
+                gpg, fingerprints, dump_file, encrypted_dump, progress
+            )
+    progress.finish()
     print('Dump successfully encrypted at %s' % gpg_file_path)
     return gpg_file_path
 
 
+def s3_client(endpoint_url=None):
+    """Return a boto3 S3 client for the dump bag.
+
+    :param endpoint_url: URL of an S3 compatible server to use instead of
+        AWS (e.g. a local minio), defaults to ODOO_DUMPS_ENDPOINT_URL.
+        The credentials are then read from the AWS_* environment variables
+        instead of the odoo-dumps profile.
+    """
+    if boto3 is None:
+        exit_msg(
+            'Missing boto3 from requirements\n'
+            'Please run `pip install -r tasks/requirements.txt`'
+        )
+    endpoint_url = endpoint_url or os.environ.get('ODOO_DUMPS_ENDPOINT_URL')
+    if endpoint_url:
+        return boto3.session.Session().client('s3', endpoint_url=endpoint_url)
+    session = boto3.session.Session(profile_name=DUMP_BAG_PROFILE)
+    return session.client('s3')
+
+
+class S3MultipartWriter(object):
+    """Writable binary stream uploaded as an S3 multipart upload.
+
+    Data is cut in parts of ``part_size`` which are uploaded by a pool of
+    threads; ``write`` blocks when ``concurrency`` parts are in flight.
+    The upload is completed when leaving the ``with`` block, or aborted
+    on an exception, including a failure to upload the last parts.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        key,
+        part_size=UPLOAD_PART_SIZE,
+        concurrency=UPLOAD_CONCURRENCY,
+        tagging=None,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        params = {'Bucket': bucket, 'Key': key}
+        if tagging:
+            params['Tagging'] = tagging
+        self.upload_id = client.create_multipart_upload(**params)['UploadId']
+        self._buffer = bytearray()
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._submit(part)
+
+    def _submit(self, data):
+        for future in self._futures:
+            if future.done() and future.exception():
+                raise future.exception()
+        self._slots.acquire()
+        future = self._executor.submit(
+            self._upload_part, len(self._futures) + 1, data
+        )
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    def close(self):
+        try:
+            # the last part may be smaller than the others (or even empty)
+            if self._buffer or not self._futures:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [future.result() for future in self._futures]
+            self._executor.shutdown()
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except Exception:
+            # uploaded parts are billed until the upload is aborted
+            self.abort()
+            raise
+
+    def abort(self):
+        self._executor.shutdown()
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+
+
+def stream_dump_to_dump_bag(ctx, db_name, compress=None, endpoint_url=None):
+    """Dump, encrypt and upload a database in one pass.
+
+    pg_dump output is piped through gpg into a multipart upload: nothing
+    is written on the disk and the memory used is bounded by the size of
+    the parts being uploaded.
+
+    :return: S3 path of the encrypted dump
+    """
+    username = getpass.getuser()
+    key = '{}/{}.gpg'.format(username, _new_dump_name())
+    client = s3_client(endpoint_url)
+    gpg = gnupg.GPG()
+    fingerprints = get_dump_bag_fingerprints(gpg)
+    with db_session(ctx) as connections:
+        cmd = [
+            'pg_dump',
+            '-h',
+            'localhost',
+            '-p',
+            str(connections.port),
+            '-U',
+            'odoo',
+            '--format=c',
+        ]
+        if compress is not None:
+            cmd += ['--compress', str(compress)]
+        cmd.append(db_name)
+        progress = TransferProgress('Dumping {}'.format(db_name))
+        dump = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=_pg_env())
+        try:
+            # ShortExpire: the dump is auto deleted after 1 week
+            with S3MultipartWriter(
+                client, DUMP_BAG_BUCKET, key, tagging='ShortExpire=True'
+            ) as upload:
+                gpg_encrypt_stream(
+                    gpg, fingerprints, dump.stdout, upload, progress
+                )
+                if dump.wait():
+                    exit_msg(
+                        'pg_dump failed with code {}'.format(dump.returncode)
+                    )
+        finally:
+            if dump.poll() is None:
+                dump.kill()
+                dump.wait()
+        progress.finish()
+    return 's3://{}/{}'.format(DUMP_BAG_BUCKET, key)
+
+
 @task(name='share-on-dumps-bag')
 def share_on_dumps_bag(ctx, dump_file_path):
     """Encrypt and push a dump to Odoo Dump bags manually.
@@ -276,7 +1766,7 @@ def share_on_dumps_bag(ctx, dump_file_path):
         'aws --profile=odoo-dumps s3api put-object-tagging '
         '--bucket odoo-dumps --key %s/%s '
         '--tagging="TagSet=[{Key=ShortExpire,Value=True}]"'
-        % (username, s3_dump_path),
+        % (username, os.path.basename(gpg_file_path)),
         hide=True,
     )
     print('Encrypted dump successfully shared on dumps bag at:', s3_dump_path)
@@ -285,21 +1775,67 @@ def share_on_dumps_bag(ctx, dump_file_path):
 
 @task(name='dump-and-share')
 def dump_and_share(
-    ctx, db_name='odoodb', tmp_path='/tmp', keep_local_dump=False
+    ctx,
+    db_name='odoodb',
+    tmp_path='/tmp',
+    keep_local_dump=False,
+    jobs=1,
+    compress=None,
+    stream=False,
+    endpoint_url=None,
 ):
     """Create a dump and share it on Odoo Dumps Bag.
 
     Usage : invoke database.dump-and-share --db-name=mydb
 
+    A parallel dump (``--jobs``) is shared as a tar archive of the dump
+    directory (``*.pgdir.tar``).
+
+    With ``--stream``, the dump is encrypted and uploaded while pg_dump
+    runs, without any local file (``--tmp-path``, ``--keep-local-dump``
+    and ``--jobs`` do not apply).
+
     :param db_name: Name of the Database to dump
     :param tmp_path: Temporary local path to store the dump
     :param keep_local_dump: Boolean to keep the generated and encrypted dumps
     locally
+    :param jobs: Number of tables dumped in parallel
+    :param compress: Compression level or method given to pg_dump
+    :param stream: Dump, encrypt and upload in one pass
+    :param endpoint_url: S3 compatible server to use instead of AWS
     """
+    if stream:
+        if int(jobs) > 1:
+            exit_msg('A parallel dump cannot be streamed')
+        s3_dump_path = stream_dump_to_dump_bag(
+            ctx, db_name, compress=compress, endpoint_url=endpoint_url
+        )
+        print(
+            'Encrypted dump successfully shared on dumps bag at:',
+            s3_dump_path,
+        )
+        print('NOTE: this dump will be auto-deleted after 7 days.')
+        return
     tmp_path = expand_path(tmp_path)
-    dump_file_path = local_dump(ctx, db_name=db_name, path=tmp_path)
+    dump_file_path = local_dump(
+        ctx, db_name=db_name, path=tmp_path, jobs=jobs, compress=compress
+    )
+    dump_dir_path = None
+    if os.path.isdir(dump_file_path):
+        # the parts are already compressed by pg_dump
+        dump_dir_path = dump_file_path
+        dump_file_path = '%s.tar' % dump_dir_path
+        ctx.run(
+            'tar -cf {} -C {} {}'.format(
+                dump_file_path,
+                os.path.dirname(dump_dir_path),
+                os.path.basename(dump_dir_path),
+            )
+        )
     share_on_dumps_bag(ctx, dump_file_path)
     if not keep_local_dump:
+        if dump_dir_path:
+            ctx.run('rm -r %s' % dump_dir_path)
         ctx.run('rm %s' % dump_file_path)
         ctx.run('rm %s.gpg' % dump_file_path)
 
@@ -319,33 +1855,162 @@ def empty_my_dump_bag(ctx):
     print('Your dumps bag has been emptied successfully.')
 
 
-def _download_from_dumpbag(ctx, s3_path_dump):
+def _split_s3_path(s3_path):
+    """Return (bucket, key) of a s3://bucket/key path"""
+    bucket, __, key = s3_path[len('s3://') :].partition('/')
+    return bucket, key
+
+
+def _part_sizes(client, bucket, key, size, etag, jobs):
+    """Return the sizes of the parts to download.
+
+    An object uploaded in parts is downloaded by the same parts, so the
+    md5 of each part is enough to check its multipart ETag. All the parts
+    but the last one usually have the size of the first one, which the
+    size of the last part confirms; otherwise each part size is asked
+    with head_object.
+    """
+    if '-' not in etag:
+        return [
+            min(DOWNLOAD_PART_SIZE, size - start)
+            for start in range(0, size, DOWNLOAD_PART_SIZE)
+        ]
+    count = int(etag.split('-')[1])
+
+    def head_part(number):
+        return client.head_object(Bucket=bucket, Key=key, PartNumber=number)[
+            'ContentLength'
+        ]
+
+    part_size = head_part(1)
+    if count == 1:
+        return [part_size]
+    last_size = size - part_size * (count - 1)
+    if 0 < last_size <= part_size and head_part(count) == last_size:
+        return [part_size] * (count - 1) + [last_size]
+    with ThreadPoolExecutor(max_workers=max(int(jobs), 1)) as executor:
+        return list(executor.map(head_part, range(1, count + 1)))
+
+
+def _download_parts(sizes):
+    """Return the parts to download as {part id: (offset, byte range)}.
+
+    The parts are fetched as byte ranges, as some S3 compatible servers
+    ignore PartNumber on a GET or send no Content-Range.
+    """
+    parts = {}
+    offset = 0
+    for number, part_size in enumerate(sizes, 1):
+        parts[str(number)] = (
+            offset,
+            'bytes={}-{}'.format(offset, offset + part_size - 1),
+        )
+        offset += part_size
+    return parts
+
+
+def _checksum_ok(etag, parts, manifest, file_path):
+    """Compare the ETag of the object with the downloaded data."""
+    if '-' in etag:
+        digests = b''.join(
+            bytes.fromhex(manifest['parts'][part_id])
+            for part_id in sorted(parts, key=int)
+        )
+        checksum = '{}-{}'.format(hashlib.md5(digests).hexdigest(), len(parts))
+    else:
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as downloaded:
+            for block in iter(lambda: downloaded.read(STREAM_BLOCK_SIZE), b''):
+                md5.update(block)
+        checksum = md5.hexdigest()
+    return checksum == etag
+
+
+def _write_manifest(manifest_path, manifest):
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.rename(manifest_path + '.tmp', manifest_path)
+
+
+def _download_from_dumpbag(
+    ctx, s3_path_dump, jobs=DOWNLOAD_CONCURRENCY, endpoint_url=None
+):
     """Download one dump from Dump-bag with Aws.
 
+    Parts of the object are downloaded concurrently into a ``.part``
+    file. Finished parts are recorded in a ``.download.json`` manifest so
+    an interrupted download resumes where it stopped. The file gets its
+    final name only once its checksum matches the ETag of the object.
+
     :param s3_path_dump: complete S3 path of dump
         as s3://odoo-dumps/fighting_snail_1024/fighting_snail_1024[...].pg.gpg
+    :param jobs: number of parts downloaded at the same time
+    :param endpoint_url: S3 compatible server to use instead of AWS
     """
-    ctx.run("aws --profile=odoo-dumps s3 cp {} .".format(s3_path_dump))
+    bucket, key = _split_s3_path(s3_path_dump)
+    client = s3_client(endpoint_url)
+    head = client.head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    etag = head['ETag'].strip('"')
+    file_path = os.path.basename(key)
+    part_path = '%s.part' % file_path
+    manifest_path = '%s.download.json' % file_path
 
+    manifest = {}
+    if os.path.isfile(manifest_path) and os.path.isfile(part_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    if (
+        manifest.get('etag') != etag
+        or manifest.get('size') != size
+        or 'part_sizes' not in manifest
+    ):
+        # new download or the object changed since the last attempt
+        manifest = {
+            'etag': etag,
+            'size': size,
+            'part_sizes': _part_sizes(client, bucket, key, size, etag, jobs),
+            'parts': {},
+        }
+        with open(part_path, 'wb') as part_file:
+            part_file.truncate(size)
+        _write_manifest(manifest_path, manifest)
+    parts = _download_parts(manifest['part_sizes'])
+    todo = [part_id for part_id in parts if part_id not in manifest['parts']]
+    if len(todo) < len(parts):
+        print('Resuming download, {} parts left'.format(len(todo)))
 
-def _get_list_of_dumps(ctx, database_name):
-    """Download one dump from Dump-bag with Aws.
+    lock = threading.Lock()
+    progress = TransferProgress(
+        'Downloading',
+        total=size,
+        initial=size * (len(parts) - len(todo)) // max(len(parts), 1),
+    )
 
-    :param database_name: database name or equal to S3 folder
-        eg: is fighting_snail_1024 for case of
-        s3://odoo-dumps/fighting_snail_1024/fighting_snail_1024[...].pg.gpg
-    :return json.loads(result_of_aws_call): a list of all dump for one
-        customer in dumpbag
-    """
-    # TODO should be available as "public task"
+    def download(part_id):
+        start, byte_range = parts[part_id]
+        response = client.get_object(Bucket=bucket, Key=key, Range=byte_range)
+        md5 = hashlib.md5()
+        with open(part_path, 'r+b') as part_file:
+            part_file.seek(start)
+            body = response['Body']
+            for block in iter(lambda: body.read(STREAM_BLOCK_SIZE), b''):
+                part_file.write(block)
+                md5.update(block)
+                with lock:
+                    progress.add(len(block))
+        with lock:
+            manifest['parts'][part_id] = md5.hexdigest()
+            _write_manifest(manifest_path, manifest)
 
-    result_of_aws_call = ctx.run(
-        "aws --profile=odoo-dumps s3api list-objects-v2 \
-        --bucket odoo-dumps --query 'Contents[].Key' \
-        --prefix {}".format(
-            database_name
-        ),
-        hide=True,
-    ).stdout.strip()
+    with ThreadPoolExecutor(max_workers=max(int(jobs), 1)) as executor:
+        for __ in executor.map(download, todo):
+            pass
+    progress.finish()
 
-    return json.loads(result_of_aws_call)
+    if not _checksum_ok(etag, parts, manifest, part_path):
+        os.remove(part_path)
+        os.remove(manifest_path)
+        exit_msg('Checksum mismatch for {}, download it again'.format(key))
+    os.rename(part_path, file_path)
+    os.remove(manifest_path)
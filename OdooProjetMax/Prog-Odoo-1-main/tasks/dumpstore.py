@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+# Copyright 2026 Kal-It
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""Local store of dumps, deduplicated by content-defined chunks.
+
+Dumps are split in chunks whose boundaries depend on their content (a
+gear rolling hash, as in FastCDC), so the chunks of two dumps of the same
+database are mostly the same even when rows were inserted in between.
+Chunks are stored once, named by their sha256 and compressed with zlib;
+each dump is a JSON manifest listing its chunks.
+
+Cutting is CPU bound: a dump file is cut by windows of CUT_WINDOW_SIZE in
+worker processes, each window as if a chunk started there. The chunks
+cut from the previous windows are followed into the next one until they
+meet a cut of its worker, from where both cut the same chunks: the result
+is the same as cutting the whole file in one pass.
+
+pg_dump compresses the custom format by default, which defeats the
+deduplication: store dumps made with ``invoke database.local-dump
+--compress=0``, the chunks are compressed by the store.
+"""
+from __future__ import print_function
+
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from invoke import task
+
+from .common import (
+    TransferProgress,
+    cache_path,
+    exit_msg,
+    human_size,
+    make_dir,
+    print_json,
+)
+from .database import expand_path
+
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 3
+# chunks hashed and compressed in parallel while the next ones are cut
+CHUNK_WORKERS = 4
+# windows of a dump file cut in parallel, by as many processes as CPUs
+CUT_WINDOW_SIZE = 64 * 1024 * 1024
+CUT_WORKERS = os.cpu_count() or 1
+_MASK_64 = 2 ** 64 - 1
+# normalized chunking: a harder condition before the average size and an
+# easier one after, on the high bits which depend on the last 64 bytes
+_MASK_S = ((1 << 22) - 1) << 42
+_MASK_L = ((1 << 18) - 1) << 46
+GEAR = tuple(
+    int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big')
+    for i in range(256)
+)
+
+
+def store_path(*names):
+    """Path in the dump store, ODOO_DUMPSTORE_PATH or the user cache"""
+    base = os.environ.get('ODOO_DUMPSTORE_PATH')
+    if not base:
+        base = os.path.dirname(cache_path('dumpstore', ''))
+    path = os.path.join(expand_path(base), *names)
+    make_dir(os.path.dirname(path))
+    return path
+
+
+def _chunk_path(digest):
+    return store_path('chunks', digest[:2], digest)
+
+
+@contextmanager
+def store_lock(exclusive=False):
+    """Lock the store: shared while dumps are added, exclusive for gc.
+
+    The chunks of a dump being added are used by no manifest until it is
+    written, gc must not run meanwhile.
+    """
+    with open(store_path('lock'), 'a') as lock_file:
+        if exclusive:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                exit_msg('Dumps are being added to the store, try later')
+        else:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+        yield
+
+
+def _find_cut(data):
+    """Return the length of the first chunk of ``data``"""
+    size = len(data)
+    if size <= MIN_CHUNK_SIZE:
+        return size
+    end = min(size, MAX_CHUNK_SIZE)
+    normal = min(end, AVG_CHUNK_SIZE)
+    gear = GEAR
+    fingerprint = 0
+    for index in range(MIN_CHUNK_SIZE, normal):
+        fingerprint = ((fingerprint << 1) + gear[data[index]]) & _MASK_64
+        if not fingerprint & _MASK_S:
+            return index + 1
+    for index in range(normal, end):
+        fingerprint = ((fingerprint << 1) + gear[data[index]]) & _MASK_64
+        if not fingerprint & _MASK_L:
+            return index + 1
+    return end
+
+
+def iter_chunks(stream):
+    """Yield the content-defined chunks of a binary stream"""
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < MAX_CHUNK_SIZE:
+            block = stream.read(READ_SIZE)
+            eof = not block
+            buf += block
+        if not buf:
+            return
+        cut = _find_cut(buf)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+
+def _window_cuts(path, start, stop):
+    """Return the ends of the chunks of a file cut from ``start``.
+
+    The file is cut as if a chunk started at ``start``, until a chunk
+    ends at or after ``stop`` (or the end of the file).
+    """
+    with open(path, 'rb') as dump_file:
+        dump_file.seek(start)
+        data = memoryview(dump_file.read(stop - start + MAX_CHUNK_SIZE))
+    cuts = []
+    pos = 0
+    while pos < len(data) and start + pos < stop:
+        pos += _find_cut(data[pos : pos + MAX_CHUNK_SIZE])
+        cuts.append(start + pos)
+    return cuts
+
+
+def iter_file_cuts(path):
+    """Yield the ends of the content-defined chunks of a file, in order.
+
+    The chunks are the ones of ``iter_chunks``, the windows of the file are
+    cut in parallel by CUT_WORKERS processes.
+    """
+    size = os.path.getsize(path)
+    starts = list(range(0, size, CUT_WINDOW_SIZE))
+    pos = 0
+    with open(path, 'rb') as dump_file, ProcessPoolExecutor(
+        max_workers=CUT_WORKERS
+    ) as executor:
+        windows = executor.map(
+            _window_cuts, [path] * len(starts), starts, starts[1:] + [size]
+        )
+        for start, window in zip(starts, windows):
+            known = set(window)
+            known.add(start)
+            # follow the chunks until they end on a cut of the window
+            while pos < window[-1] and pos not in known:
+                dump_file.seek(pos)
+                pos += _find_cut(dump_file.read(MAX_CHUNK_SIZE))
+                yield pos
+            for cut in window:
+                if cut > pos:
+                    pos = cut
+                    yield pos
+
+
+def _store_chunk(chunk):
+    """Write a chunk if it is not in the store yet.
+
+    :return: (digest, size, stored size or 0 if already stored)
+    """
+    digest = hashlib.sha256(chunk).hexdigest()
+    path = _chunk_path(digest)
+    if os.path.exists(path):
+        return digest, len(chunk), 0
+    data = zlib.compress(chunk, COMPRESS_LEVEL)
+    # a chunk may be written by two threads when a dump repeats it
+    tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+    with open(tmp_path, 'wb') as chunk_file:
+        chunk_file.write(data)
+    os.rename(tmp_path, path)
+    return digest, len(chunk), len(data)
+
+
+def read_chunk(digest):
+    """Return the content of a chunk, checked against its digest"""
+    try:
+        with open(_chunk_path(digest), 'rb') as chunk_file:
+            chunk = zlib.decompress(chunk_file.read())
+    except (IOError, OSError, zlib.error) as e:
+        raise ValueError('Chunk {} is unreadable: {}'.format(digest, e))
+    if hashlib.sha256(chunk).hexdigest() != digest:
+        raise ValueError('Chunk {} is corrupted'.format(digest))
+    return chunk
+
+
+def get_manifests():
+    """Return the manifests of the store, the most recent first"""
+    manifests = []
+    manifest_dir = os.path.dirname(store_path('manifests', ''))
+    for filename in os.listdir(manifest_dir):
+        if filename.endswith('.json'):
+            with open(os.path.join(manifest_dir, filename)) as manifest_file:
+                manifests.append(json.load(manifest_file))
+    return sorted(manifests, key=lambda m: m['created'], reverse=True)
+
+
+def get_manifest(name):
+    path = store_path('manifests', '{}.json'.format(name))
+    if not os.path.isfile(path):
+        exit_msg('No dump {} in the store'.format(name))
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+@task(
+    name='add',
+    help={
+        'name': 'Name of the dump in the store, its file name by default',
+        'remove': 'Remove the dump file once stored',
+    },
+)
+def add(ctx, dump_path, name=None, remove=False):
+    """Store a dump file, only its new chunks take space."""
+    dump_path = expand_path(dump_path)
+    if not os.path.isfile(dump_path):
+        exit_msg('{} is not a file'.format(dump_path))
+    name = name or os.path.basename(dump_path)
+    digest = hashlib.sha256()
+    chunks = []
+    stored = 0
+    with store_lock():
+        progress = TransferProgress(
+            'Storing {}'.format(name), total=os.path.getsize(dump_path)
+        )
+        with open(dump_path, 'rb') as dump_file, ThreadPoolExecutor(
+            max_workers=CHUNK_WORKERS
+        ) as executor:
+            pending = deque()
+            for cut in iter_file_cuts(dump_path):
+                chunk = dump_file.read(cut - dump_file.tell())
+                digest.update(chunk)
+                pending.append(executor.submit(_store_chunk, chunk))
+                # bound the chunks held in memory
+                while len(pending) > CHUNK_WORKERS * 2 or (
+                    pending and pending[0].done()
+                ):
+                    future = pending.popleft()
+                    chunk_digest, size, chunk_stored = future.result()
+                    chunks.append([chunk_digest, size])
+                    stored += chunk_stored
+                    progress.add(size)
+            for future in pending:
+                chunk_digest, size, chunk_stored = future.result()
+                chunks.append([chunk_digest, size])
+                stored += chunk_stored
+                progress.add(size)
+        progress.finish()
+        manifest = {
+            'name': name,
+            'size': sum(size for __, size in chunks),
+            'sha256': digest.hexdigest(),
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'chunks': chunks,
+        }
+        path = store_path('manifests', '{}.json'.format(name))
+        with open(path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.rename(path + '.tmp', path)
+    print(
+        '{} stored: {} chunks, {} added to the store'.format(
+            name, len(chunks), human_size(stored)
+        )
+    )
+    if remove:
+        os.remove(dump_path)
+
+
+@task(name='list')
+def list_dumps(ctx, json_output=False):
+    """List the dumps of the store and the space they use together."""
+    manifests = get_manifests()
+    for manifest in manifests:
+        manifest['chunks'] = len(manifest['chunks'])
+    chunk_dir = os.path.dirname(store_path('chunks', ''))
+    used = sum(
+        entry.stat().st_size
+        for sub_dir in os.scandir(chunk_dir)
+        if sub_dir.is_dir()
+        for entry in os.scandir(sub_dir.path)
+    )
+    if json_output:
+        print_json({'dumps': manifests, 'used': used})
+        return
+    for manifest in manifests:
+        print(
+            '{} {:>10} {:>6} chunks {}'.format(
+                manifest['created'],
+                human_size(manifest['size']),
+                manifest['chunks'],
+                manifest['name'],
+            )
+        )
+    print(
+        '{} of dumps stored in {}'.format(
+            human_size(sum(m['size'] for m in manifests)), human_size(used)
+        )
+    )
+
+
+@task(
+    name='restore',
+    help={'output': "Path of the rebuilt dump, '-' for the standard output"},
+)
+def restore(ctx, name, output=None):
+    """Rebuild a dump from its chunks.
+
+    With ``--output -``, the dump is streamed to the standard output, to
+    be piped into ``pg_restore`` without writing it on disk. Each chunk
+    and the whole dump are checked against their sha256.
+    """
+    manifest = get_manifest(name)
+    if output == '-':
+        outstream = getattr(sys.stdout, 'buffer', sys.stdout)
+        progress = None
+    else:
+        output = expand_path(output or name)
+        outstream = open(output + '.part', 'wb')
+        progress = TransferProgress(
+            'Restoring {}'.format(name), total=manifest['size']
+        )
+    digest = hashlib.sha256()
+    try:
+        for chunk_digest, __ in manifest['chunks']:
+            chunk = read_chunk(chunk_digest)
+            digest.update(chunk)
+            outstream.write(chunk)
+            if progress:
+                progress.add(len(chunk))
+    except ValueError as e:
+        exit_msg(str(e))
+    finally:
+        outstream.flush()
+        if output != '-':
+            outstream.close()
+    if digest.hexdigest() != manifest['sha256']:
+        exit_msg('Checksum mismatch for {}'.format(name))
+    if output != '-':
+        os.rename(output + '.part', output)
+        progress.finish()
+
+
+@task(name='verify')
+def verify(ctx, name=None):
+    """Check that the chunks of the dumps (or one dump) are intact."""
+    manifests = [get_manifest(name)] if name else get_manifests()
+    digests = {
+        chunk_digest
+        for manifest in manifests
+        for chunk_digest, __ in manifest['chunks']
+    }
+
+    def check(chunk_digest):
+        try:
+            read_chunk(chunk_digest)
+        except ValueError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+        errors = [error for error in executor.map(check, digests) if error]
+    for error in errors:
+        print(error)
+    if errors:
+        exit_msg(
+            '{} chunks of {} are damaged'.format(len(errors), len(digests))
+        )
+    print(
+        '{} chunks of {} dumps verified'.format(len(digests), len(manifests))
+    )
+
+
+@task(name='evict')
+def evict(ctx, name):
+    """Remove a dump from the store, its chunks are freed by gc."""
+    get_manifest(name)
+    os.remove(store_path('manifests', '{}.json'.format(name)))
+    print('Dump {} removed'.format(name))
+
+
+@task(
+    name='gc',
+    help={'keep': 'Number of the most recent dumps to keep, all by default'},
+)
+def gc(ctx, keep=None):
+    """Delete the chunks no dump uses anymore.
+
+    gc does not run while dumps are being added to the store.
+    """
+    with store_lock(exclusive=True):
+        _gc(ctx, keep)
+
+
+def _gc(ctx, keep):
+    manifests = get_manifests()
+    if keep is not None:
+        for manifest in manifests[int(keep) :]:
+            evict(ctx, manifest['name'])
+        manifests = manifests[: int(keep)]
+    used = {
+        chunk_digest
+        for manifest in manifests
+        for chunk_digest, __ in manifest['chunks']
+    }
+    freed = count = 0
+    chunk_dir = os.path.dirname(store_path('chunks', ''))
+    for sub_dir in os.scandir(chunk_dir):
+        if not sub_dir.is_dir():
+            continue
+        for entry in os.scandir(sub_dir.path):
+            if entry.name not in used:
+                freed += entry.stat().st_size
+                count += 1
+                os.remove(entry.path)
+    print('{} chunks deleted, {} freed'.format(count, human_size(freed)))
@@ -2,66 +2,729 @@
 # Copyright 2019 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from pprint import pprint
+import os
+import shlex
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+import psycopg2
+import yaml
 from invoke import task
+from psycopg2 import sql
 
-from .database import get_db_list, get_db_request_result
+from .common import MIGRATION_FILE, human_size, print_json
+from .database import db_session, get_db_list
 
+MODULES_SQL = """
+    SELECT
+        m.name,
+        m.state,
+        m.latest_version,
+        array_remove(array_agg(d.name ORDER BY d.name), NULL)
+    FROM
+        ir_module_module m
+        LEFT JOIN ir_module_module_dependency d ON d.module_id = m.id
+    WHERE
+        m.state IN ('to install', 'to upgrade', 'installed')
+    GROUP BY
+        m.id
+    ORDER BY
+        m.name;
+"""
 
-@task(name='check-modules')
-def check_modules(ctx, migrated_db, full_db, sample_db):
-    """Print modules comparison between given databases"""
+
+def _fetch_modules(connections, db_name):
+    """Return {name: {state, version, depends}} of a database modules"""
+    with connections.cursor(db_name) as db_cursor:
+        db_cursor.execute(MODULES_SQL)
+        return {
+            name: {'state': state, 'version': version, 'depends': depends}
+            for name, state, version, depends in db_cursor.fetchall()
+        }
+
+
+def _reverse_closure(modules, names):
+    """Return {name: modules depending on it, directly or not}"""
+    dependents = {}
+    for name, module in modules.items():
+        for depend in module['depends']:
+            dependents.setdefault(depend, set()).add(name)
+    result = {}
+    for name in names:
+        seen = set()
+        todo = list(dependents.get(name, ()))
+        while todo:
+            dependent = todo.pop()
+            if dependent not in seen:
+                seen.add(dependent)
+                todo.extend(dependents.get(dependent, ()))
+        result[name] = sorted(seen)
+    return result
+
+
+def _unmet_dependencies(modules):
+    """Return {name: dependencies not installed nor to install}"""
+    return {
+        name: sorted(set(module['depends']) - set(modules))
+        for name, module in modules.items()
+        if set(module['depends']) - set(modules)
+    }
+
+
+def compare_modules(migrated, full, sample=None):
+    """Compare the modules of the databases given as _fetch_modules dicts.
+
+    In migrated database, we get "to install", "to update" and "installed"
+    modules, in full database, we only get "installed" modules: modules
+    are compared on their name, not their state.
+    """
+    migrated_only = sorted(set(migrated) - set(full))
+    result = {
+        'migrated_not_full': _reverse_closure(migrated, migrated_only),
+        'full_not_migrated': _reverse_closure(
+            full, sorted(set(full) - set(migrated))
+        ),
+        'version_differences': {
+            name: {
+                'migrated': migrated[name]['version'],
+                'full': full[name]['version'],
+            }
+            for name in sorted(set(migrated) & set(full))
+            if migrated[name]['version'] != full[name]['version']
+        },
+        'unmet_dependencies': {
+            'migrated': _unmet_dependencies(migrated),
+            'full': _unmet_dependencies(full),
+        },
+    }
+    if sample is not None:
+        result['full_not_sample'] = sorted(set(full) - set(sample))
+        result['sample_not_full'] = sorted(set(sample) - set(full))
+        result['unmet_dependencies']['sample'] = _unmet_dependencies(sample)
+    return result
+
+
+def _print_section(title, values):
+    print('')
+    print(title)
+    if not values:
+        print('    (none)')
+    for value in values:
+        print('    {}'.format(value))
+
+
+def _print_comparison(comparison):
+    _print_section(
+        'Modules in migrated database, but not in full database:',
+        [
+            '{} (required by: {})'.format(name, ', '.join(dependents))
+            if dependents
+            else name
+            for name, dependents in comparison['migrated_not_full'].items()
+        ],
+    )
+    _print_section(
+        'Modules in full database, but not in migrated database:',
+        [
+            '{} (required by: {})'.format(name, ', '.join(dependents))
+            if dependents
+            else name
+            for name, dependents in comparison['full_not_migrated'].items()
+        ],
+    )
+    _print_section(
+        'Modules with a different version (migrated / full):',
+        [
+            '{}: {} / {}'.format(name, versions['migrated'], versions['full'])
+            for name, versions in comparison['version_differences'].items()
+        ],
+    )
+    if 'full_not_sample' in comparison:
+        _print_section(
+            'Modules in full database, but not in sample database:',
+            comparison['full_not_sample'],
+        )
+        _print_section(
+            'Modules in sample database, but not in full database:',
+            comparison['sample_not_full'],
+        )
+    for db_kind, unmet in comparison['unmet_dependencies'].items():
+        _print_section(
+            'Modules with missing dependencies in {} database:'.format(
+                db_kind
+            ),
+            [
+                '{}: {}'.format(name, ', '.join(depends))
+                for name, depends in sorted(unmet.items())
+            ],
+        )
+
+
+@task(
+    name='check-modules',
+    help={'json-output': 'Print the comparison as JSON'},
+)
+def check_modules(
+    ctx, migrated_db, full_db, sample_db=None, json_output=False
+):
+    """Print modules comparison between given databases
+
+    The modules of the databases are fetched concurrently, and compared
+    on their name, version and dependencies.
+    """
     can_continue = True
-    db_list = get_db_list(ctx)
-    if migrated_db not in db_list:
-        print("Migrated database `%s` not found" % migrated_db)
-        can_continue = False
-    if full_db not in db_list:
-        print("Full database `%s` not found" % full_db)
-        can_continue = False
-    if sample_db and sample_db not in db_list:
-        print("Sample database `%s` not found" % sample_db)
-        can_continue = False
-
-    if can_continue:
-        sql = """
-            SELECT
-                name,
-                state
-            FROM
-                ir_module_module
-            WHERE
-                state IN ('to install', 'to upgrade', 'installed')
-            ORDER BY
-                name;
+    with db_session(ctx) as connections:
+        db_list = get_db_list(ctx)
+        if migrated_db not in db_list:
+            print("Migrated database `%s` not found" % migrated_db)
+            can_continue = False
+        if full_db not in db_list:
+            print("Full database `%s` not found" % full_db)
+            can_continue = False
+        if sample_db and sample_db not in db_list:
+            print("Sample database `%s` not found" % sample_db)
+            can_continue = False
+        if not can_continue:
+            return
+
+        db_names = [migrated_db, full_db] + ([sample_db] if sample_db else [])
+        with ThreadPoolExecutor(max_workers=len(db_names)) as executor:
+            modules = list(
+                executor.map(
+                    lambda db_name: _fetch_modules(connections, db_name),
+                    db_names,
+                )
+            )
+    comparison = compare_modules(*modules)
+    if json_output:
+        print_json(comparison)
+    else:
+        _print_comparison(comparison)
+
+
+# every query returns (key, value) tuples, objects are compared on their
+# key (e.g. table and column) and reported as changed when values differ
+SCHEMA_QUERIES = (
+    (
+        'tables',
+        """
+        SELECT c.relname, c.relkind::text
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm')
+        """,
+    ),
+    (
+        'columns',
+        """
+        SELECT c.relname || '.' || a.attname,
+               format_type(a.atttypid, a.atttypmod)
+               || CASE WHEN a.attnotnull THEN ' NOT NULL' ELSE '' END
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+        AND a.attnum > 0 AND NOT a.attisdropped
+        """,
+    ),
+    (
+        'indexes',
+        # the same index may have another name, compare the definitions
         """
-        migrated_modules = get_db_request_result(ctx, migrated_db, sql) or []
-        full_modules = get_db_request_result(ctx, full_db, sql) or []
-        sample_modules = get_db_request_result(ctx, sample_db, sql) or []
-
-        print('')
-        print('Modules in migrated database:')
-        pprint(set(migrated_modules))
-
-        print('')
-        print('Modules in full database:')
-        pprint(set(full_modules))
-
-        print('')
-        print('Modules in migrated database, but not in full database:')
-        # In migrated database,
-        # we get "to install", "to update" and  "installed" modules
-        #
-        # In full database, we only get "installed" modules
-        #
-        # So we just compare modules name without their state
-        pprint({x[0] for x in migrated_modules} - {x[0] for x in full_modules})
-
-        print('')
-        print('Modules in full database, but not in sample database:')
-        pprint(set(full_modules) - set(sample_modules))
-
-        print('')
-        print('Modules in sample database, but not in full database:')
-        pprint(set(sample_modules) - set(full_modules))
+        SELECT regexp_replace(
+                   pg_get_indexdef(i.indexrelid), 'INDEX \\S+ ON', 'INDEX ON'
+               ),
+               ic.relname
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = ic.relnamespace
+        WHERE n.nspname = 'public'
+        """,
+    ),
+    (
+        'constraints',
+        """
+        SELECT c.conrelid::regclass::text || '.' || c.conname,
+               pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        JOIN pg_namespace n ON n.oid = c.connamespace
+        WHERE n.nspname = 'public' AND c.conrelid <> 0
+        """,
+    ),
+    (
+        'sequences',
+        """
+        SELECT sequencename, data_type::text || ' by ' || increment_by
+        FROM pg_sequences
+        WHERE schemaname = 'public'
+        """,
+    ),
+)
+
+
+def _fetch_schema(connections, db_name):
+    """Return {kind: {key: value}} of a database catalog"""
+    schema = {}
+    with connections.cursor(db_name) as db_cursor:
+        for kind, query in SCHEMA_QUERIES:
+            db_cursor.execute(query)
+            schema[kind] = dict(db_cursor.fetchall())
+    return schema
+
+
+def compare_schemas(migrated, reference):
+    """Return {kind: {missing, extra, changed}} between two schemas.
+
+    ``missing`` are in the reference but not in the migrated database.
+    Columns of tables missing on one side are not listed, the table is.
+    """
+    tables = set(migrated['tables']) & set(reference['tables'])
+    result = {}
+    for kind, __ in SCHEMA_QUERIES:
+        ours, theirs = migrated[kind], reference[kind]
+        if kind == 'columns':
+            ours = {k: v for k, v in ours.items() if k.split('.')[0] in tables}
+            theirs = {
+                k: v for k, v in theirs.items() if k.split('.')[0] in tables
+            }
+        changed = {}
+        if kind != 'indexes':  # the value of an index is only its name
+            changed = {
+                key: {'migrated': ours[key], 'reference': theirs[key]}
+                for key in sorted(set(ours) & set(theirs))
+                if ours[key] != theirs[key]
+            }
+        result[kind] = {
+            'missing': sorted(set(theirs) - set(ours)),
+            'extra': sorted(set(ours) - set(theirs)),
+            'changed': changed,
+        }
+    return result
+
+
+@task(
+    name='schema-diff',
+    help={'json-output': 'Print the differences as JSON'},
+)
+def schema_diff(ctx, migrated_db, reference_db, json_output=False):
+    """Compare the tables, columns, indexes, constraints and sequences.
+
+    Both catalogs are read concurrently with a few queries on pg_catalog,
+    which takes seconds even with thousands of tables. ``missing`` objects
+    exist in the reference database only, ``extra`` ones in the migrated
+    database only.
+    """
+    with db_session(ctx) as connections:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            migrated, reference = executor.map(
+                lambda db_name: _fetch_schema(connections, db_name),
+                [migrated_db, reference_db],
+            )
+    diff = compare_schemas(migrated, reference)
+    if json_output:
+        print_json(diff)
+        return
+    for kind, __ in SCHEMA_QUERIES:
+        _print_section(
+            'Missing {} in migrated database:'.format(kind),
+            diff[kind]['missing'],
+        )
+        _print_section(
+            'Extra {} in migrated database:'.format(kind),
+            diff[kind]['extra'],
+        )
+        if diff[kind]['changed']:
+            _print_section(
+                'Changed {} (migrated / reference):'.format(kind),
+                [
+                    '{}: {} / {}'.format(
+                        key, values['migrated'], values['reference']
+                    )
+                    for key, values in diff[kind]['changed'].items()
+                ],
+            )
+
+
+# reltuples is 0 (-1 from PostgreSQL 14) until a table is analyzed, the
+# number of live rows counted by the statistics collector is used instead
+VOLUMES_SQL = """
+    SELECT c.relname,
+        CASE WHEN s.last_analyze IS NOT NULL
+            OR s.last_autoanalyze IS NOT NULL
+        THEN c.reltuples::bigint ELSE s.n_live_tup END,
+        pg_total_relation_size(c.oid)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+"""
+
+
+def _fetch_volumes(connections, db_name):
+    """Return {table: {rows, size}} with the row estimates of a database.
+
+    ``rows`` is the planner estimate of the analyzed tables, the number
+    of live rows of the statistics collector for the others, and None
+    when there is neither.
+    """
+    with connections.cursor(db_name) as db_cursor:
+        db_cursor.execute(VOLUMES_SQL)
+        return {
+            table: {
+                'rows': rows if rows is not None and rows >= 0 else None,
+                'size': size,
+            }
+            for table, rows, size in db_cursor.fetchall()
+        }
+
+
+def _count_rows(connections, db_name, table):
+    with connections.cursor(db_name) as db_cursor:
+        db_cursor.execute(
+            sql.SQL('SELECT count(*) FROM {}').format(sql.Identifier(table))
+        )
+        return db_name, table, db_cursor.fetchone()[0]
+
+
+def compare_volumes(volumes, threshold=0.5):
+    """Return the tables whose rows changed between migrated and full.
+
+    ``volumes`` is {db_kind: _fetch_volumes dict} with the ``migrated`` and
+    ``full`` kinds, and optionally ``sample``. A table is listed when it
+    exists on one side only, or when its number of rows changed by more
+    than ``threshold`` (0.5 is 50%). The biggest changes come first.
+    """
+    migrated, full = volumes['migrated'], volumes['full']
+    result = []
+    for table in set(migrated) | set(full):
+        rows = {
+            db_kind: tables.get(table, {}).get('rows')
+            for db_kind, tables in volumes.items()
+        }
+        sizes = {
+            db_kind: tables.get(table, {}).get('size')
+            for db_kind, tables in volumes.items()
+        }
+        if table in migrated and table in full:
+            before, after = rows['full'] or 0, rows['migrated'] or 0
+            if abs(after - before) <= threshold * max(before, 1):
+                continue
+            delta = after - before
+        else:
+            delta = (rows['migrated'] or 0) - (rows['full'] or 0)
+        result.append(
+            {'table': table, 'rows': rows, 'sizes': sizes, 'delta': delta}
+        )
+    return sorted(result, key=lambda item: -abs(item['delta']))
+
+
+def _format_rows(rows):
+    return '-' if rows is None else '{:,}'.format(rows)
+
+
+def _print_volumes(comparison, db_kinds):
+    print(
+        '{:<40} '.format('table')
+        + ' '.join('{:>15}'.format(db_kind) for db_kind in db_kinds)
+        + ' {:>15} {:>10} {:>10}'.format('delta', 'migr. size', 'full size')
+    )
+    for item in comparison:
+        sizes = item['sizes']
+        print(
+            '{:<40} '.format(item['table'])
+            + ' '.join(
+                '{:>15}'.format(_format_rows(item['rows'][db_kind]))
+                for db_kind in db_kinds
+            )
+            + ' {:>15} {:>10} {:>10}'.format(
+                '{:+,}'.format(item['delta']),
+                human_size(sizes['migrated'] or 0),
+                human_size(sizes['full'] or 0),
+            )
+        )
+
+
+@task(
+    name='volume-diff',
+    help={
+        'exact': 'Count the rows with count(*) instead of using the '
+        'planner estimates',
+        'jobs': 'Number of tables counted in parallel with --exact',
+        'threshold': 'Minimum relative change of the number of rows to '
+        'list a table (default 0.5 for 50%)',
+        'json-output': 'Print the comparison as JSON',
+    },
+)
+def volume_diff(
+    ctx,
+    migrated_db,
+    full_db,
+    sample_db=None,
+    exact=False,
+    jobs=8,
+    threshold=0.5,
+    json_output=False,
+):
+    """Compare the number of rows and the size of the tables.
+
+    By default, the number of rows comes from the planner statistics
+    (``pg_class.reltuples``), which are only as fresh as the last ANALYZE
+    but cost nothing to read, or for the tables never analyzed from the
+    live rows of ``pg_stat_user_tables``. With ``--exact``, every table is
+    counted, the biggest first, in parallel over all the databases.
+    """
+    db_names = {'migrated': migrated_db, 'full': full_db}
+    if sample_db:
+        db_names['sample'] = sample_db
+    with db_session(ctx) as connections:
+        with ThreadPoolExecutor(max_workers=len(db_names)) as executor:
+            volumes = dict(
+                zip(
+                    db_names,
+                    executor.map(
+                        lambda db_name: _fetch_volumes(connections, db_name),
+                        db_names.values(),
+                    ),
+                )
+            )
+        if exact:
+            tables = sorted(
+                (
+                    (tables[table]['size'], db_kind, table)
+                    for db_kind, tables in volumes.items()
+                    for table in tables
+                ),
+                reverse=True,
+            )
+            with ThreadPoolExecutor(max_workers=int(jobs)) as executor:
+                counts = executor.map(
+                    lambda item: _count_rows(
+                        connections, db_names[item[1]], item[2]
+                    ),
+                    tables,
+                )
+                kinds = {db_name: kind for kind, db_name in db_names.items()}
+                for db_name, table, count in counts:
+                    volumes[kinds[db_name]][table]['rows'] = count
+    comparison = compare_volumes(volumes, threshold=float(threshold))
+    if json_output:
+        print_json(comparison)
+    else:
+        _print_volumes(comparison, list(db_names))
+
+
+STEP_WRAPPER = '/odoo-bin/marabunta_step.py'
+# a step is flagged when its last run is that much slower than usual
+SLOWER_RATIO = 1.5
+# the mode of docker-compose.yml
+DEFAULT_MARABUNTA_MODE = 'sample'
+
+
+def _fetch_timings(connections, db_name):
+    """Return (versions, steps) recorded in a database.
+
+    ``versions`` is {number: seconds} of the migrated versions, ``steps``
+    a list of {version, phase, command, date_start, duration}.
+    """
+    try:
+        with connections.cursor(db_name) as db_cursor:
+            db_cursor.execute(
+                """
+                SELECT number,
+                       extract(epoch FROM date_done - date_start)::float
+                FROM marabunta_version
+                WHERE date_done IS NOT NULL
+                """
+            )
+            versions = dict(db_cursor.fetchall())
+            db_cursor.execute(
+                """
+                SELECT version, phase, command, date_start, duration::float
+                FROM marabunta_step_timing
+                WHERE returncode = 0
+                ORDER BY date_start
+                """
+            )
+            columns = [column.name for column in db_cursor.description]
+            steps = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+    except psycopg2.ProgrammingError:
+        # databases migrated before the steps were timed
+        return {}, []
+    return versions, steps
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _migration_steps(mode=None):
+    """Return [(version, [(phase, command)])] of migration.yml.
+
+    As Marabunta does, the operations of the ``mode`` of a version run
+    after its main operations.
+    """
+    with open(MIGRATION_FILE) as migration_file:
+        migration = yaml.safe_load(migration_file)
+    result = []
+    for version in migration['migration']['versions']:
+        operations = [version.get('operations') or {}]
+        if mode:
+            mode_version = (version.get('modes') or {}).get(mode) or {}
+            operations.append(mode_version.get('operations') or {})
+        steps = []
+        for phase in ('pre', 'post'):
+            commands = [
+                command
+                for phase_operations in operations
+                for command in phase_operations.get(phase) or []
+            ]
+            for command in commands:
+                args = shlex.split(command)
+                if args and args[0] == STEP_WRAPPER:
+                    args = args[3:]
+                steps.append((phase, ' '.join(args)))
+        result.append((str(version['version']), steps))
+    return result
+
+
+def compute_timings(timings, migrated, mode=None):
+    """Return the history of the steps and the estimate of pending versions.
+
+    ``timings`` is a list of _fetch_timings results, the first one being
+    the database to migrate, whose ``migrated`` versions are not pending.
+    The addons upgrade of a version is the time of the version not spent
+    in the last run of its pre and post steps.
+    """
+    runs = defaultdict(list)
+    for versions, steps in timings:
+        latest = {}
+        for step in steps:
+            key = (step['version'], step['phase'], step['command'])
+            runs[key].append((step['date_start'], step['duration']))
+            # the steps are ordered by date_start
+            latest[key] = step
+        spent = defaultdict(float)
+        last_start = {}
+        for step in latest.values():
+            spent[step['version']] += step['duration']
+            last_start[step['version']] = max(
+                last_start.get(step['version'], step['date_start']),
+                step['date_start'],
+            )
+        for number, total in versions.items():
+            if number in spent:
+                runs[(number, 'addons', '')].append(
+                    (last_start[number], max(total - spent[number], 0))
+                )
+    # durations of each step, the most recent run last
+    history = {
+        key: [duration for __, duration in sorted(key_runs)]
+        for key, key_runs in runs.items()
+    }
+    steps = []
+    for (version, phase, command), durations in sorted(history.items()):
+        usual = _median(durations[:-1]) if len(durations) > 1 else None
+        steps.append(
+            {
+                'version': version,
+                'phase': phase,
+                'command': command,
+                'runs': len(durations),
+                'last': durations[-1],
+                'median': _median(durations),
+                'slower': bool(usual and durations[-1] > SLOWER_RATIO * usual),
+            }
+        )
+    pending = []
+    for version, version_steps in _migration_steps(mode):
+        if version in migrated:
+            continue
+        estimates = [
+            _median(history.get((version, phase, command), []))
+            for phase, command in version_steps
+        ]
+        estimates.append(_median(history.get((version, 'addons', ''), [])))
+        pending.append(
+            {
+                'version': version,
+                'estimate': sum(e for e in estimates if e is not None),
+                'unknown_steps': sum(1 for e in estimates if e is None),
+            }
+        )
+    return {
+        'steps': steps,
+        'pending': pending,
+        'estimate': sum(version['estimate'] for version in pending),
+    }
+
+
+@task(
+    name='timings',
+    help={
+        'history-dbs': 'Comma separated databases where the migration ran '
+        'before, e.g. rehearsals, to use in the history',
+        'json-output': 'Print the timings as JSON',
+        'mode': 'Marabunta mode of the migration, MARABUNTA_MODE or '
+        '{} by default'.format(DEFAULT_MARABUNTA_MODE),
+    },
+)
+def timings(ctx, db_name, history_dbs='', json_output=False, mode=None):
+    """Show the duration of the migration steps and estimate the pending.
+
+    The durations are recorded by /odoo-bin/marabunta_step.py in the
+    marabunta_step_timing table of each database. Steps whose last run
+    is much slower than the previous ones are flagged. The runtime of the
+    versions of migration.yml not yet migrated in ``db_name`` is estimated
+    from the median of the past runs, with the operations of ``mode``.
+    """
+    db_names = [db_name] + [name for name in history_dbs.split(',') if name]
+    with db_session(ctx) as connections:
+        with ThreadPoolExecutor(max_workers=len(db_names)) as executor:
+            all_timings = list(
+                executor.map(
+                    lambda name: _fetch_timings(connections, name), db_names
+                )
+            )
+    mode = mode or os.environ.get('MARABUNTA_MODE', DEFAULT_MARABUNTA_MODE)
+    result = compute_timings(
+        all_timings, migrated=set(all_timings[0][0]), mode=mode
+    )
+    if json_output:
+        print_json(result)
+        return
+    _print_section(
+        'Steps (runs, last / median):',
+        [
+            '{} {} {}: {} runs, {:.1f}s / {:.1f}s{}'.format(
+                step['version'],
+                step['phase'],
+                step['command'],
+                step['runs'],
+                step['last'],
+                step['median'],
+                ' (slower)' if step['slower'] else '',
+            )
+            for step in result['steps']
+        ],
+    )
+    _print_section(
+        'Pending versions:',
+        [
+            '{}: {:.1f}s{}'.format(
+                version['version'],
+                version['estimate'],
+                ' ({} steps never timed)'.format(version['unknown_steps'])
+                if version['unknown_steps']
+                else '',
+            )
+            for version in result['pending']
+        ],
+    )
+    print('')
+    print('Estimated runtime: {:.1f}s'.format(result['estimate']))
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# Copyright 2026 Kal-It
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from __future__ import print_function
+
+import hashlib
+import json
+from datetime import datetime
+
+from invoke import task
+from psycopg2.sql import SQL, Identifier
+
+from .common import cd, exit_msg, human_size, print_json, root_path
+from .database import db_session, get_db_version
+
+# the sources of the addons: a snapshot made with other addons is stale
+ADDONS_PATHS = (
+    'odoo/src',
+    'odoo/external-src',
+    'odoo/local-src',
+    'odoo/songs',
+    'odoo/migration.yml',
+)
+SNAPSHOT_PREFIX = 'snap_'
+
+
+def addons_hash(ctx):
+    """Hash of the addons tree, including submodules and local changes"""
+    with cd(root_path()):
+        tree = ctx.run(
+            'git ls-tree HEAD {}'.format(' '.join(ADDONS_PATHS)), hide=True
+        ).stdout
+        diff = ctx.run(
+            'git diff HEAD -- {}'.format(' '.join(ADDONS_PATHS)), hide=True
+        ).stdout
+    return hashlib.sha1((tree + diff).encode('utf-8')).hexdigest()[:12]
+
+
+def _snapshot_name(source, tree_hash):
+    key = hashlib.sha1(
+        '{}:{}'.format(source, tree_hash).encode('utf-8')
+    ).hexdigest()[:12]
+    return SNAPSHOT_PREFIX + key
+
+
+def get_snapshots(connections):
+    """Return the snapshots as a list of dicts, the most recent first.
+
+    Snapshots are template databases whose metadata are stored as JSON in
+    the comment of the database.
+    """
+    with connections.cursor('postgres') as db_cursor:
+        db_cursor.execute(
+            """
+            SELECT datname,
+                   shobj_description(oid, 'pg_database'),
+                   pg_database_size(oid)
+            FROM pg_database
+            WHERE datistemplate
+            AND datname LIKE %s
+            """,
+            (SNAPSHOT_PREFIX + '%',),
+        )
+        rows = db_cursor.fetchall()
+    snapshots = []
+    for name, comment, size in rows:
+        try:
+            snapshot = json.loads(comment or '{}')
+        except ValueError:
+            snapshot = {}
+        snapshot.update({'name': name, 'size': size})
+        snapshots.append(snapshot)
+    return sorted(
+        snapshots, key=lambda snap: snap.get('created', ''), reverse=True
+    )
+
+
+def _set_metadata(db_cursor, snapshot):
+    metadata = {k: v for k, v in snapshot.items() if k not in ('name', 'size')}
+    db_cursor.execute(
+        SQL('COMMENT ON DATABASE {} IS %s').format(
+            Identifier(snapshot['name'])
+        ),
+        (json.dumps(metadata),),
+    )
+
+
+def _drop_snapshot(db_cursor, name):
+    db_cursor.execute(
+        SQL('ALTER DATABASE {} IS_TEMPLATE false').format(Identifier(name))
+    )
+    db_cursor.execute(SQL('DROP DATABASE {}').format(Identifier(name)))
+
+
+def _terminate_connections(db_cursor, db_name):
+    db_cursor.execute(
+        """
+        SELECT pg_terminate_backend(pid)
+        FROM pg_stat_activity
+        WHERE datname = %s AND pid <> pg_backend_pid()
+        """,
+        (db_name,),
+    )
+
+
+@task(
+    name='create',
+    help={
+        'dump-name': 'Name of the dump the database was restored from, '
+        'used as key instead of its Marabunta version',
+        'force': 'Close the connections to the source database',
+    },
+)
+def create(ctx, db_name, dump_name=None, force=False):
+    """Snapshot a database as a template database.
+
+    The snapshot is keyed by the dump it comes from (or the Marabunta
+    version of the database) and the hash of the addons tree, so it is
+    only reused with the same code. An existing snapshot for the same key
+    is replaced.
+    """
+    tree_hash = addons_hash(ctx)
+    with db_session(ctx) as connections:
+        source = dump_name
+        version = None
+        if not source:
+            version = get_db_version(connections, db_name)[1]
+            if version == 'unknown':
+                exit_msg(
+                    'No Marabunta version in {}, please give '
+                    '--dump-name'.format(db_name)
+                )
+            source = 'version:{}'.format(version)
+        name = _snapshot_name(source, tree_hash)
+        tmp_name = '{}_tmp'.format(name)
+        with connections.cursor('postgres') as db_cursor:
+            # a leftover of an interrupted creation
+            db_cursor.execute(
+                SQL('DROP DATABASE IF EXISTS {}').format(Identifier(tmp_name))
+            )
+            if force:
+                _terminate_connections(db_cursor, db_name)
+            # the connection of the pool would prevent to copy it
+            connections.close()
+            # copied under a temporary name, so the previous snapshot is
+            # kept when the copy fails (e.g. the source is in use)
+            db_cursor.execute(
+                SQL('CREATE DATABASE {} TEMPLATE {}').format(
+                    Identifier(tmp_name), Identifier(db_name)
+                )
+            )
+            if any(s['name'] == name for s in get_snapshots(connections)):
+                _drop_snapshot(db_cursor, name)
+            db_cursor.execute(
+                SQL('ALTER DATABASE {} RENAME TO {}').format(
+                    Identifier(tmp_name), Identifier(name)
+                )
+            )
+            db_cursor.execute(
+                SQL('ALTER DATABASE {} IS_TEMPLATE true').format(
+                    Identifier(name)
+                )
+            )
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            snapshot = {
+                'name': name,
+                'source': source,
+                'db_name': db_name,
+                'version': version,
+                'addons_hash': tree_hash,
+                'created': now,
+                'last_used': now,
+            }
+            _set_metadata(db_cursor, snapshot)
+    print('Snapshot {} created from {} ({})'.format(name, db_name, source))
+
+
+@task(
+    name='restore',
+    help={
+        'dump-name': 'Use the snapshot of this dump',
+        'version': 'Use the snapshot of this Marabunta version',
+    },
+)
+def restore(ctx, db_name, dump_name=None, version=None):
+    """Create a database from the snapshot matching the current addons.
+
+    Without ``--dump-name`` nor ``--version``, the most recent snapshot
+    made with the current addons is used.
+    """
+    tree_hash = addons_hash(ctx)
+    with db_session(ctx) as connections:
+        snapshots = [
+            s
+            for s in get_snapshots(connections)
+            if s.get('addons_hash') == tree_hash
+        ]
+        if dump_name:
+            snapshots = [s for s in snapshots if s.get('source') == dump_name]
+        if version:
+            snapshots = [s for s in snapshots if s.get('version') == version]
+        if not snapshots:
+            exit_msg('No snapshot found for the current addons')
+        snapshot = snapshots[0]
+        with connections.cursor('postgres') as db_cursor:
+            db_cursor.execute(
+                SQL('CREATE DATABASE {} TEMPLATE {} OWNER odoo').format(
+                    Identifier(db_name), Identifier(snapshot['name'])
+                )
+            )
+            snapshot['last_used'] = datetime.now().strftime(
+                '%Y-%m-%d %H:%M:%S'
+            )
+            _set_metadata(db_cursor, snapshot)
+    print(
+        'Database {} created from snapshot {} ({})'.format(
+            db_name, snapshot['name'], snapshot.get('source')
+        )
+    )
+
+
+@task(name='list')
+def list_snapshots(ctx, json_output=False):
+    """List the snapshots, flagging the ones made with other addons."""
+    tree_hash = addons_hash(ctx)
+    with db_session(ctx) as connections:
+        snapshots = get_snapshots(connections)
+    for snapshot in snapshots:
+        snapshot['current'] = snapshot.get('addons_hash') == tree_hash
+    if json_output:
+        print_json(snapshots)
+        return
+    for snapshot in snapshots:
+        print(
+            '{:<18} {:<40} {:>10} {} {}'.format(
+                snapshot['name'],
+                snapshot.get('source', '?'),
+                human_size(snapshot['size']),
+                snapshot.get('last_used', '?'),
+                '' if snapshot['current'] else '(stale addons)',
+            )
+        )
+
+
+@task(name='evict')
+def evict(ctx, name):
+    """Drop a snapshot by name (snap_...) or source (dump name)."""
+    with db_session(ctx) as connections:
+        snapshots = [
+            s
+            for s in get_snapshots(connections)
+            if name in (s['name'], s.get('source'))
+        ]
+        if not snapshots:
+            exit_msg('No snapshot {}'.format(name))
+        with connections.cursor('postgres') as db_cursor:
+            for snapshot in snapshots:
+                _drop_snapshot(db_cursor, snapshot['name'])
+                print('Snapshot {} dropped'.format(snapshot['name']))
+
+
+@task(
+    name='gc',
+    help={
+        'keep': 'Number of snapshots made with the current addons to keep',
+        'keep-stale': 'Keep the snapshots made with other addons',
+    },
+)
+def gc(ctx, keep=3, keep_stale=False):
+    """Drop stale snapshots and the least recently used ones."""
+    tree_hash = addons_hash(ctx)
+    with db_session(ctx) as connections:
+        snapshots = get_snapshots(connections)
+        current = sorted(
+            (s for s in snapshots if s.get('addons_hash') == tree_hash),
+            key=lambda snap: snap.get('last_used', ''),
+            reverse=True,
+        )
+        to_drop = current[int(keep) :]
+        if not keep_stale:
+            to_drop += [s for s in snapshots if s not in current]
+        freed = 0
+        with connections.cursor('postgres') as db_cursor:
+            for snapshot in to_drop:
+                _drop_snapshot(db_cursor, snapshot['name'])
+                freed += snapshot['size']
+                print('Snapshot {} dropped'.format(snapshot['name']))
+    print('{} freed'.format(human_size(freed)))
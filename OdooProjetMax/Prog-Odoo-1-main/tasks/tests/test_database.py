@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright 2026 Kal-It
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import io
+import threading
+import unittest
+
+from tasks import database
+
+
+class ResetStream(io.BytesIO):
+    """Body of an S3 object whose connection is reset after some data"""
+
+    def read(self, size=-1):
+        if self.tell() >= 3 * database.STREAM_BLOCK_SIZE:
+            raise ConnectionResetError('Connection reset by peer')
+        return super().read(size)
+
+
+class TestRestoreStream(unittest.TestCase):
+    def restore_stream(self, response, decrypt_cmd, restore_cmd):
+        result = {}
+
+        def run():
+            try:
+                result['error'] = database._restore_stream(
+                    'dump.pg', response, decrypt_cmd, restore_cmd, None
+                )
+            except Exception as e:
+                result['exception'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), 'the pipeline is stuck')
+        return result
+
+    def test_download_error(self):
+        data = b'x' * 10 * database.STREAM_BLOCK_SIZE
+        response = {'Body': ResetStream(data), 'ContentLength': len(data)}
+        result = self.restore_stream(
+            response, ['cat'], ['sh', '-c', 'cat > /dev/null']
+        )
+        self.assertIsInstance(result['exception'], ConnectionResetError)
+
+    def test_restore_error(self):
+        data = b'x' * 10 * database.STREAM_BLOCK_SIZE
+        response = {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+        result = self.restore_stream(
+            response, ['cat'], ['sh', '-c', 'head -c 10 > /dev/null; exit 3']
+        )
+        self.assertEqual(result['error'], 'pg_restore failed with code 3')
+
+    def test_success(self):
+        data = b'x' * 10 * database.STREAM_BLOCK_SIZE
+        response = {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+        result = self.restore_stream(
+            response, ['cat'], ['sh', '-c', 'cat > /dev/null']
+        )
+        self.assertIsNone(result['error'])
+
+
+class TestMatchDump(unittest.TestCase):
+    dumps = [
+        {'name': 'a-20240103-100000.pg.gpg', 'date': '2024-01-03 10:00:00'},
+        {'name': 'a-20240105-090000.pg.gpg', 'date': '2024-01-05 09:00:00'},
+        {'name': 'a-20240105-180000.pg.gpg', 'date': '2024-01-05 18:00:00'},
+    ]
+
+    def test_latest(self):
+        self.assertEqual(database._match_dump(self.dumps), self.dumps[2])
+
+    def test_name(self):
+        self.assertEqual(
+            database._match_dump(self.dumps, 'a-20240105-090000.pg'),
+            self.dumps[1],
+        )
+
+    def test_date(self):
+        self.assertEqual(
+            database._match_dump(self.dumps, '2024-01-05'), self.dumps[2]
+        )
+        self.assertIsNone(database._match_dump(self.dumps, '2024-01-04'))
+
+    def test_unknown_name(self):
+        self.assertIsNone(database._match_dump(self.dumps, 'typo-name.pg'))
+
+
+class PartsClient(object):
+    """S3 client answering head_object for the parts of an object"""
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.heads = []
+
+    def head_object(self, Bucket, Key, PartNumber):
+        self.heads.append(PartNumber)
+        return {'ContentLength': self.sizes[PartNumber - 1]}
+
+
+class TestPartSizes(unittest.TestCase):
+    def part_sizes(self, client):
+        return database._part_sizes(
+            client,
+            'bucket',
+            'key',
+            sum(client.sizes),
+            'etag-{}'.format(len(client.sizes)),
+            4,
+        )
+
+    def test_same_sizes(self):
+        client = PartsClient([8, 8, 8, 3])
+        self.assertEqual(self.part_sizes(client), [8, 8, 8, 3])
+        self.assertEqual(client.heads, [1, 4])
+
+    def test_different_sizes(self):
+        client = PartsClient([8, 10, 2])
+        self.assertEqual(self.part_sizes(client), [8, 10, 2])
+        self.assertEqual(sorted(client.heads), [1, 1, 2, 3, 3])
+
+    def test_not_multipart(self):
+        size = database.DOWNLOAD_PART_SIZE * 2 + 1
+        self.assertEqual(
+            database._part_sizes(None, 'bucket', 'key', size, 'etag', 4),
+            [database.DOWNLOAD_PART_SIZE, database.DOWNLOAD_PART_SIZE, 1],
+        )
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright 2026 Kal-It
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from tasks import migrate
+
+MIGRATION_YML = """
+migration:
+  versions:
+    - version: 14.0.1
+      operations:
+        pre:
+          - /odoo-bin/marabunta_step.py 14.0.1 pre anthem songs.base
+        post:
+          - anthem songs.main
+      modes:
+        full:
+          operations:
+            post:
+              - anthem songs.full
+        sample:
+          operations:
+            post:
+              - anthem songs.sample
+    - version: 14.0.2
+"""
+
+
+class TestMigrationSteps(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'migration.yml')
+        with open(path, 'w') as migration_file:
+            migration_file.write(MIGRATION_YML)
+        migration_file = migrate.MIGRATION_FILE
+        migrate.MIGRATION_FILE = path
+        self.addCleanup(setattr, migrate, 'MIGRATION_FILE', migration_file)
+
+    def test_mode(self):
+        self.assertEqual(
+            migrate._migration_steps('full'),
+            [
+                (
+                    '14.0.1',
+                    [
+                        ('pre', 'anthem songs.base'),
+                        ('post', 'anthem songs.main'),
+                        ('post', 'anthem songs.full'),
+                    ],
+                ),
+                ('14.0.2', []),
+            ],
+        )
+
+    def test_no_mode(self):
+        self.assertEqual(
+            migrate._migration_steps()[0][1],
+            [('pre', 'anthem songs.base'), ('post', 'anthem songs.main')],
+        )
+
+    def test_rerun_steps(self):
+        def step(hour, phase, command, duration):
+            return {
+                'version': '14.0.1',
+                'phase': phase,
+                'command': command,
+                'date_start': datetime(2026, 1, 1, hour),
+                'duration': duration,
+            }
+
+        # the migration failed once after its pre step and ran again
+        steps = [
+            step(1, 'pre', 'anthem songs.base', 10.0),
+            step(2, 'pre', 'anthem songs.base', 12.0),
+            step(2, 'post', 'anthem songs.main', 5.0),
+        ]
+        result = migrate.compute_timings(
+            [({'14.0.1': 100.0}, steps)], migrated={'14.0.1'}, mode='full'
+        )
+        addons = [s for s in result['steps'] if s['phase'] == 'addons']
+        self.assertEqual(addons[0]['last'], 83.0)
+        pending = [version['version'] for version in result['pending']]
+        self.assertEqual(pending, ['14.0.2'])